@@ -1,5 +1,11 @@
+import argparse
+import json
+import math
 import random
+import time
+from collections import defaultdict
 
+import numpy as np
 import pygame
 
 SCREEN_WIDTH, SCREEN_HEIGHT = 800, 600
@@ -23,73 +29,60 @@ class Boid:
     def update(self):
         self.position += self.velocity
 
-    def apply_behaviors(self, boids):
-        alignment = self.align(boids)
-        cohesion = self.cohere(boids)
-        separation = self.separate(boids)
-        boundary_avoidance = self.avoid_boundaries()
+    def apply_behaviors(self, boids, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        self.velocity = self.next_velocity(boids, width, height)
 
-        self.velocity += alignment + cohesion + separation + boundary_avoidance
-        if self.velocity.length() > MAX_SPEED:
-            self.velocity.scale_to_length(MAX_SPEED)
+    def next_velocity(self, boids, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        velocity = self.velocity + self.steer(boids) + self.avoid_boundaries(width, height)
+        if velocity.length() > MAX_SPEED:
+            velocity.scale_to_length(MAX_SPEED)
+        return velocity
 
-    def align(self, boids):
-        steering = pygame.Vector2(0, 0)
-        total = 0
-        avg_vector = pygame.Vector2(0, 0)
+    def steer(self, boids):
+        # Alignment, cohesion and separation from a single pass over the other boids: the offset to each one is
+        # computed once, radius tests use its squared length and only boids inside SEPARATION_DISTANCE need a sqrt.
+        velocity_sum = pygame.Vector2(0, 0)
+        offset_sum = pygame.Vector2(0, 0)
+        away_sum = pygame.Vector2(0, 0)
+        total = too_close = 0
         for other in boids:
-            if other != self and self.position.distance_to(other.position) < NEIGHBOR_RADIUS:
-                avg_vector += other.velocity
+            if other is self:
+                continue
+            offset = other.position - self.position
+            distance_sq = offset.length_squared()
+            if distance_sq < NEIGHBOR_RADIUS ** 2:
+                velocity_sum += other.velocity
+                offset_sum += offset
                 total += 1
-        if total > 0:
-            avg_vector /= total
-            avg_vector.scale_to_length(MAX_SPEED)
-            steering = avg_vector - self.velocity
-        return steering * ALIGNMENT_FACTOR
+                if 0 < distance_sq < SEPARATION_DISTANCE ** 2:
+                    away_sum -= offset / math.sqrt(distance_sq)
+                    too_close += 1
 
-    def cohere(self, boids):
         steering = pygame.Vector2(0, 0)
-        total = 0
-        center_of_mass = pygame.Vector2(0, 0)
-        for other in boids:
-            if other != self and self.position.distance_to(other.position) < NEIGHBOR_RADIUS:
-                center_of_mass += other.position
-                total += 1
         if total > 0:
-            center_of_mass /= total
-            direction_to_com = center_of_mass - self.position
-            direction_to_com.scale_to_length(MAX_SPEED)
-            steering = direction_to_com - self.velocity
-        return steering * COHESION_FACTOR
+            steering += self.turn_towards(velocity_sum / total) * ALIGNMENT_FACTOR
+            steering += self.turn_towards(offset_sum / total) * COHESION_FACTOR
+        if too_close > 0:
+            steering += self.turn_towards(away_sum / too_close) * SEPARATION_FACTOR
+        return steering
 
-    def separate(self, boids):
-        steering = pygame.Vector2(0, 0)
-        total = 0
-        for other in boids:
-            distance = self.position.distance_to(other.position)
-            if other != self and distance < SEPARATION_DISTANCE:
-                diff = self.position - other.position
-                diff /= distance
-                steering += diff
-                total += 1
-        if total > 0:
-            steering /= total
-        if steering.length() > 0:
-            steering.scale_to_length(MAX_SPEED)
-            steering = steering - self.velocity
-        return steering * SEPARATION_FACTOR
+    def turn_towards(self, direction):
+        if direction.length_squared() == 0:
+            return pygame.Vector2(0, 0)
+        direction.scale_to_length(MAX_SPEED)
+        return direction - self.velocity
 
-    def avoid_boundaries(self):
+    def avoid_boundaries(self, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
         steering = pygame.Vector2(0, 0)
 
         if self.position.x < BOUNDARY_AVOIDANCE_DISTANCE:
             steering.x = MAX_SPEED
-        elif self.position.x > SCREEN_WIDTH - BOUNDARY_AVOIDANCE_DISTANCE:
+        elif self.position.x > width - BOUNDARY_AVOIDANCE_DISTANCE:
             steering.x = -MAX_SPEED
 
         if self.position.y < BOUNDARY_AVOIDANCE_DISTANCE:
             steering.y = MAX_SPEED
-        elif self.position.y > SCREEN_HEIGHT - BOUNDARY_AVOIDANCE_DISTANCE:
+        elif self.position.y > height - BOUNDARY_AVOIDANCE_DISTANCE:
             steering.y = -MAX_SPEED
 
         if steering.length() > 0:
@@ -98,14 +91,331 @@ class Boid:
         return steering * BOUNDARY_AVOIDANCE_FACTOR
 
 
-if __name__ == "__main__":
+class SpatialHash:
+    # Buckets boids into square cells of NEIGHBOR_RADIUS, so every boid within that radius of a point is in the
+    # 3x3 block of cells around it. Boids are moved between buckets as they move, so queries stay exact even while
+    # the flock is being updated one boid at a time.
+    def __init__(self, boids, cell_size=NEIGHBOR_RADIUS):
+        self.cell_size = cell_size
+        self.buckets = defaultdict(list)
+        for boid in boids:
+            self.buckets[self.cell(boid.position)].append(boid)
+
+    def cell(self, position):
+        return math.floor(position.x / self.cell_size), math.floor(position.y / self.cell_size)
+
+    def nearby(self, position):
+        cx, cy = self.cell(position)
+        return [boid for dx in (-1, 0, 1) for dy in (-1, 0, 1) for boid in self.buckets.get((cx + dx, cy + dy), ())]
+
+    def move(self, boid, old_cell):
+        new_cell = self.cell(boid.position)
+        if new_cell != old_cell:
+            self.buckets[old_cell].remove(boid)
+            self.buckets[new_cell].append(boid)
+
+
+class ObjectFlock:
+    # One object per boid. By default a step is double-buffered: every boid steers from the previous frame's
+    # positions and velocities, then all of them move, so the result does not depend on the update order. With
+    # sequential=True boids are updated one after another as before, each seeing the ones before it already moved.
+    engine = "object"
+
+    def __init__(self, count, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, seed=None, sequential=False):
+        if seed is not None:
+            random.seed(seed)
+        self.width, self.height = width, height
+        self.sequential = sequential
+        self.boids = [Boid(random.randint(0, int(width)), random.randint(0, int(height))) for _ in range(count)]
+        self.grid = SpatialHash(self.boids)
+
+    def step(self):
+        if self.sequential:
+            for boid in self.boids:
+                old_cell = self.grid.cell(boid.position)
+                boid.apply_behaviors(self.grid.nearby(boid.position), self.width, self.height)
+                boid.update()
+                self.grid.move(boid, old_cell)
+            return
+
+        velocities = [boid.next_velocity(self.grid.nearby(boid.position), self.width, self.height)
+                      for boid in self.boids]
+        self.move(velocities)
+
+    def timed_step(self, timings):
+        # step() with the time spent in each phase added to timings. Sequential updates interleave the phases, so
+        # they are timed as a whole.
+        start = time.perf_counter()
+        if self.sequential:
+            self.step()
+            timings["step"] += time.perf_counter() - start
+            return
+        nearby = [self.grid.nearby(boid.position) for boid in self.boids]
+        searched = time.perf_counter()
+        velocities = [boid.next_velocity(boids, self.width, self.height) for boid, boids in zip(self.boids, nearby)]
+        steered = time.perf_counter()
+        self.move(velocities)
+        timings["neighbours"] += searched - start
+        timings["rules"] += steered - searched
+        timings["integration"] += time.perf_counter() - steered
+
+    def move(self, velocities):
+        for boid, velocity in zip(self.boids, velocities):
+            old_cell = self.grid.cell(boid.position)
+            boid.velocity = velocity
+            boid.update()
+            self.grid.move(boid, old_cell)
+
+    def positions(self):
+        return [(boid.position.x, boid.position.y) for boid in self.boids]
+
+
+def scale_rows(vectors, length):
+    # Rescales every non-zero row to the given length, like Vector2.scale_to_length; zero rows are left alone.
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    nonzero = norms > 0
+    scaled = np.zeros_like(vectors)
+    scaled[nonzero] = vectors[nonzero] * (length / norms[nonzero])[:, None]
+    return scaled, nonzero
+
+
+class Flock:
+    # Whole flock in N x 2 float arrays. Every rule is evaluated for all boids at once from the same state (the
+    # synchronous semantics of ObjectFlock), using the pairs that a cell list finds within NEIGHBOR_RADIUS; only
+    # the separation pairs need a square root.
+    engine = "array"
+
+    def __init__(self, count, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, seed=None):
+        rng = np.random.default_rng(seed)
+        self.width, self.height = width, height
+        self.position = rng.uniform((0, 0), (width, height), size=(count, 2))
+        self.velocity, _ = scale_rows(rng.uniform(-1, 1, size=(count, 2)), MAX_SPEED)
+
+    @classmethod
+    def from_state(cls, position, velocity, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        flock = cls(0, width, height)
+        flock.position, flock.velocity = position, velocity
+        return flock
+
+    def neighbour_pairs(self):
+        # Boids are sorted by NEIGHBOR_RADIUS-sized cell, column by column, so the candidates of each boid are three
+        # contiguous runs of the sorted order: the cells above, level with and below it in the column to its left,
+        # its own column and the column to its right. Boids beyond the edges share the edge cells, which never
+        # separates two boids that are within the radius of each other.
+        columns, rows = math.ceil(self.width / NEIGHBOR_RADIUS), math.ceil(self.height / NEIGHBOR_RADIUS)
+        x, y = self.position[:, 0].copy(), self.position[:, 1].copy()
+        cx = np.clip(x // NEIGHBOR_RADIUS, 0, columns - 1).astype(np.intp)
+        cy = np.clip(y // NEIGHBOR_RADIUS, 0, rows - 1).astype(np.intp)
+        order = np.argsort(cx * rows + cy, kind="stable")
+        ends = np.cumsum(np.bincount(cx * rows + cy, minlength=columns * rows))
+        starts = np.concatenate([[0], ends[:-1]])
+
+        column = cx[:, None] + np.array([-1, 0, 1])
+        inside = (column >= 0) & (column < columns)
+        column = np.clip(column, 0, columns - 1) * rows
+        first = starts[column + np.maximum(cy - 1, 0)[:, None]]
+        runs = np.where(inside, ends[column + np.minimum(cy + 1, rows - 1)[:, None]] - first, 0).ravel()
+        per_boid = runs.reshape(-1, 3).sum(axis=1)
+        i = np.repeat(np.arange(len(x)), per_boid)
+        j = order[np.repeat(first.ravel() - np.cumsum(runs) + runs, runs) + np.arange(len(i))]
+
+        dx, dy = x[j] - np.repeat(x, per_boid), y[j] - np.repeat(y, per_boid)
+        distance_sq = dx * dx + dy * dy
+        near = (distance_sq < NEIGHBOR_RADIUS ** 2) & (i != j)
+        return i[near], j[near], np.stack([dx[near], dy[near]], axis=1), distance_sq[near]
+
+    def steering(self, pairs=None):
+        count = len(self.position)
+        i, j, offset, distance_sq = self.neighbour_pairs() if pairs is None else pairs
+        neighbours = np.bincount(i, minlength=count)[:, None]
+        has_neighbours = neighbours[:, 0] > 0
+        total = np.maximum(neighbours, 1)
+
+        average_velocity = pair_sums(i, self.velocity[j], count) / total
+        alignment, aligned = scale_rows(average_velocity, MAX_SPEED)
+        alignment = np.where((has_neighbours & aligned)[:, None], alignment - self.velocity, 0)
+
+        to_centre = pair_sums(i, offset, count) / total
+        cohesion, cohered = scale_rows(to_centre, MAX_SPEED)
+        cohesion = np.where((has_neighbours & cohered)[:, None], cohesion - self.velocity, 0)
+
+        close = (distance_sq > 0) & (distance_sq < SEPARATION_DISTANCE ** 2)
+        away = -offset[close] / np.sqrt(distance_sq[close])[:, None]
+        too_close = np.maximum(np.bincount(i[close], minlength=count), 1)[:, None]
+        separation, separated = scale_rows(pair_sums(i[close], away, count) / too_close, MAX_SPEED)
+        separation = np.where(separated[:, None], separation - self.velocity, 0)
+
+        x, y = self.position[:, 0], self.position[:, 1]
+        push = np.stack([np.where(x < BOUNDARY_AVOIDANCE_DISTANCE, MAX_SPEED,
+                                  np.where(x > self.width - BOUNDARY_AVOIDANCE_DISTANCE, -MAX_SPEED, 0)),
+                         np.where(y < BOUNDARY_AVOIDANCE_DISTANCE, MAX_SPEED,
+                                  np.where(y > self.height - BOUNDARY_AVOIDANCE_DISTANCE, -MAX_SPEED, 0))], axis=1)
+        avoidance, avoiding = scale_rows(push.astype(float), MAX_SPEED)
+        avoidance = np.where(avoiding[:, None], avoidance - self.velocity, 0)
+
+        return (alignment * ALIGNMENT_FACTOR + cohesion * COHESION_FACTOR + separation * SEPARATION_FACTOR +
+                avoidance * BOUNDARY_AVOIDANCE_FACTOR)
+
+    def step(self):
+        self.position, self.velocity = self.advance(self.steering())
+
+    def timed_step(self, timings):
+        start = time.perf_counter()
+        pairs = self.neighbour_pairs()
+        searched = time.perf_counter()
+        steering = self.steering(pairs)
+        steered = time.perf_counter()
+        self.position, self.velocity = self.advance(steering)
+        timings["neighbours"] += searched - start
+        timings["rules"] += steered - searched
+        timings["integration"] += time.perf_counter() - steered
+
+    def advance(self, steering):
+        # Next positions and velocities as new arrays, leaving the current state untouched.
+        velocity = self.velocity + steering
+        speed_sq = np.einsum("ij,ij->i", velocity, velocity)
+        too_fast = speed_sq > MAX_SPEED ** 2
+        velocity[too_fast] *= (MAX_SPEED / np.sqrt(speed_sq[too_fast]))[:, None]
+        return self.position + velocity, velocity
+
+    def positions(self):
+        return self.position
+
+
+def pair_sums(i, values, count):
+    return np.stack([np.bincount(i, weights=values[:, 0], minlength=count),
+                     np.bincount(i, weights=values[:, 1], minlength=count)], axis=1)
+
+
+def parallel_flock(count, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, seed=None, jobs=None):
+    # boids_parallel imports this module, so it is only imported once the parallel engine is picked.
+    from boids_parallel import ParallelFlock
+    return ParallelFlock(count, width, height, seed, jobs)
+
+
+ENGINES = {ObjectFlock.engine: ObjectFlock, Flock.engine: Flock, "parallel": parallel_flock}
+
+
+def world_size(count):
+    # The world grows with the flock so the density, and with it the neighbours per boid, stays the same as
+    # NUM_BOIDS on one screen; per-frame cost should then grow linearly with the boid count.
+    scale = math.sqrt(count / NUM_BOIDS)
+    return SCREEN_WIDTH * scale, SCREEN_HEIGHT * scale
+
+
+def benchmark(engine, counts, frames, seed=0, **options):
+    for count in counts:
+        flock = ENGINES[engine](count, *world_size(count), seed, **options)
+        start = time.perf_counter()
+        for _ in range(frames):
+            flock.step()
+        frame_ms = (time.perf_counter() - start) / frames * 1000
+        if hasattr(flock, "close"):
+            flock.close()
+        print(f"{count:6d} boids: {frame_ms:8.2f} ms/frame, {frame_ms / count * 1000:6.2f} us/boid")
+
+
+def headless(engine, count, frames, seed=None, record=None, **options):
+    # Steps the flock as fast as it goes and reports where the time went. With record, positions of every frame
+    # (the starting one included) are written as float32 to a memory-mapped .npy file, with the world size and run
+    # settings in <record>.json next to it.
+    width, height = world_size(count)
+    flock = ENGINES[engine](count, width, height, seed, **options)
+    trajectory = None
+    if record is not None:
+        trajectory = np.lib.format.open_memmap(record, mode="w+", dtype=np.float32, shape=(frames + 1, count, 2))
+        trajectory[0] = flock.positions()
+        with open(f"{record}.json", "w") as f:
+            json.dump({"engine": engine, "boids": count, "frames": frames, "seed": seed, "width": width,
+                       "height": height, **options}, f, indent=2)
+
+    timings = defaultdict(float)
+    recording = 0.0
+    start = time.perf_counter()
+    for frame in range(1, frames + 1):
+        flock.timed_step(timings)
+        if trajectory is not None:
+            recorded = time.perf_counter()
+            trajectory[frame] = flock.positions()
+            recording += time.perf_counter() - recorded
+    elapsed = time.perf_counter() - start
+    if trajectory is not None:
+        trajectory.flush()
+        timings["recording"] = recording
+    if hasattr(flock, "close"):
+        flock.close()
+
+    print(f"{count} boids, {frames} frames: {frames / elapsed:.1f} steps/s ({elapsed / frames * 1000:.2f} ms/step)")
+    for phase, seconds in timings.items():
+        print(f"  {phase:<12} {seconds / frames * 1000:8.2f} ms/step {seconds / elapsed:6.1%}")
+
+
+def play(path, fps):
+    # Replays a recorded trajectory without stepping a flock, scaled down to fit the screen. Loops at the end.
+    with open(f"{path}.json") as f:
+        meta = json.load(f)
+    trajectory = np.load(path, mmap_mode="r")
+    zoom = min(SCREEN_WIDTH / meta["width"], SCREEN_HEIGHT / meta["height"], 1)
+    radius = max(1, round(5 * zoom))
+
+    pygame.init()
+    screen = pygame.display.set_mode((math.ceil(meta["width"] * zoom), math.ceil(meta["height"] * zoom)))
+    clock = pygame.time.Clock()
+
+    frame = 0
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        screen.fill((30, 30, 30))
+        for x, y in (trajectory[frame] * zoom).astype(int).tolist():
+            pygame.draw.circle(screen, (255, 255, 255), (x, y), radius)
+        pygame.display.flip()
+        pygame.display.set_caption(f"Boids replay: frame {frame}/{len(trajectory) - 1}, {clock.get_fps():.0f} FPS")
+        frame = (frame + 1) % len(trajectory)
+        clock.tick(fps)
+
+    pygame.quit()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Boids flocking simulation.")
+    parser.add_argument("--engine", choices=ENGINES, default="object",
+                        help="one object per boid, the NumPy Flock that updates every boid at once, or that Flock "
+                             "stepped in strips on a process pool")
+    parser.add_argument("--sequential", action="store_true",
+                        help="object engine only: update boids one after another instead of from the previous frame")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="parallel engine only: worker processes (default: one per core)")
+    parser.add_argument("--boids", type=int, default=NUM_BOIDS)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--benchmark", type=int, nargs="*", default=None, metavar="BOIDS",
+                        help="time frames for these flock sizes instead of opening a window")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="frames per benchmark size (default 20) or headless run (default 1000)")
+    parser.add_argument("--headless", action="store_true",
+                        help="step --boids boids without a window and report steps/s per phase")
+    parser.add_argument("--record", default=None, metavar="FILE", help="headless only: write positions to this .npy")
+    parser.add_argument("--play", default=None, metavar="FILE", help="replay a recorded trajectory")
+    parser.add_argument("--fps", type=int, default=60, help="replay frame rate cap, 0 for none")
+    args = parser.parse_args()
+    if args.sequential and args.engine != ObjectFlock.engine:
+        parser.error("--sequential needs the object engine")
+    if args.jobs is not None and args.engine != "parallel":
+        parser.error("--jobs needs the parallel engine")
+    if args.record is not None and not args.headless:
+        parser.error("--record needs --headless")
+    return args
+
+
+def run(flock):
     pygame.init()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Boids Simulation")
     clock = pygame.time.Clock()
 
-    boids = [Boid(random.randint(0, SCREEN_WIDTH), random.randint(0, SCREEN_HEIGHT)) for _ in range(NUM_BOIDS)]
-
     running = True
     while running:
         screen.fill((30, 30, 30))
@@ -114,12 +424,26 @@ if __name__ == "__main__":
             if event.type == pygame.QUIT:
                 running = False
 
-        for boid in boids:
-            boid.apply_behaviors(boids)
-            boid.update()
-            pygame.draw.circle(screen, (255, 255, 255), (int(boid.position.x), int(boid.position.y)), 5)
+        flock.step()
+        for x, y in flock.positions():
+            pygame.draw.circle(screen, (255, 255, 255), (int(x), int(y)), 5)
 
         pygame.display.flip()
         clock.tick(60)
 
     pygame.quit()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    options = {"sequential": True} if args.sequential else {}
+    if args.jobs is not None:
+        options["jobs"] = args.jobs
+    if args.play is not None:
+        play(args.play, args.fps)
+    elif args.headless:
+        headless(args.engine, args.boids, args.frames or 1000, args.seed, args.record, **options)
+    elif args.benchmark is not None:
+        benchmark(args.engine, args.benchmark or [100, 500, 1000, 2000, 5000], args.frames or 20, **options)
+    else:
+        run(ENGINES[args.engine](args.boids, seed=args.seed, **options))
@@ -0,0 +1,93 @@
+import argparse
+import os
+import time
+from functools import partial
+
+import numpy as np
+
+from boids import NEIGHBOR_RADIUS, SCREEN_HEIGHT, SCREEN_WIDTH, Flock, world_size
+from sharedblocks import StripPool, attach
+
+
+def flock_buffers(buffer, count):
+    # Two frames of positions and velocities: [frame, 0] holds positions and [frame, 1] velocities.
+    return np.ndarray((2, 2, count, 2), dtype=np.float64, buffer=buffer)
+
+
+def attached(name, count):
+    return attach(name, flock_buffers, count)
+
+
+def step_strip(name, count, width, height, strips, front, strip):
+    # Advances the boids whose previous x lies in one vertical strip. They are stepped together with every boid
+    # within NEIGHBOR_RADIUS of the strip, read from the previous frame; only the strip's own boids are written to
+    # the other frame, so strips never write to the same rows.
+    buffers = attached(name, count)
+    position, velocity = buffers[front]
+    x = position[:, 0]
+    owner = np.clip((x * strips // width).astype(np.intp), 0, strips - 1)
+    left = -np.inf if strip == 0 else strip * width / strips
+    right = np.inf if strip == strips - 1 else (strip + 1) * width / strips
+    nearby = np.flatnonzero((owner == strip) | ((x > left - NEIGHBOR_RADIUS) & (x < right + NEIGHBOR_RADIUS)))
+
+    local = Flock.from_state(position[nearby], velocity[nearby], width, height)
+    next_position, next_velocity = local.advance(local.steering())
+    own = owner[nearby] == strip
+    buffers[1 - front, 0, nearby[own]] = next_position[own]
+    buffers[1 - front, 1, nearby[own]] = next_velocity[own]
+
+
+class ParallelFlock(StripPool):
+    # Flock stepped by a process pool over shared memory. The flock is double-buffered: every worker reads the
+    # previous frame and writes its strip's boids into the other one, so a frame costs a single round of tasks.
+    # Results are identical to Flock for any number of workers.
+    engine = "parallel"
+
+    def __init__(self, count, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, seed=None, jobs=None, strips=None):
+        flock = Flock(count, width, height, seed)
+        self.width, self.height = width, height
+        self.count = count
+        self.strips = strips or jobs or os.cpu_count()
+        self.buffers = self.open_block(2 * 2 * count * 2 * 8, flock_buffers, count, jobs=jobs)
+        self.front = 0
+        self.buffers[0, 0], self.buffers[0, 1] = flock.position, flock.velocity
+
+    def step(self):
+        self.map_strips(partial(step_strip, self.block.name, self.count, self.width, self.height, self.strips,
+                                self.front))
+        self.front = 1 - self.front
+
+    def timed_step(self, timings):
+        # The rules run inside the workers, so only the whole round of strip tasks is timed.
+        start = time.perf_counter()
+        self.step()
+        timings["strips"] += time.perf_counter() - start
+
+    def positions(self):
+        return self.buffers[self.front, 0]
+
+    def velocities(self):
+        return self.buffers[self.front, 1]
+
+    def close(self):
+        del self.buffers
+        super().close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Step a large flock headless on all cores.")
+    parser.add_argument("--boids", type=int, default=100000)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--strips", type=int, default=None, help="vertical strips (default: one per worker)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    with ParallelFlock(args.boids, *world_size(args.boids), args.seed, args.jobs, args.strips) as flock:
+        flock.step()
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            flock.step()
+        elapsed = time.perf_counter() - start
+    print(f"{args.boids} boids, {flock.strips} strips: {args.frames / elapsed:.1f} steps/s "
+          f"({elapsed / args.frames * 1000:.1f} ms/step)")
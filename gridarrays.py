@@ -0,0 +1,44 @@
+import itertools
+
+import numpy as np
+
+# Neighbour order shared by every table below: up, down, left, right on the [x, y] grid.
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+PERMUTATIONS = list(itertools.permutations(range(4)))
+FIRST_OPTION = np.array([[next((d for d in order if mask >> d & 1), 0) for order in PERMUTATIONS]
+                         for mask in range(16)], dtype=np.intp)
+
+
+def neighbour_table(grid_size):
+    return neighbour_cells(np.arange(grid_size * grid_size), grid_size)
+
+
+def neighbour_cells(cells, grid_size):
+    # Flat indices of the four toroidal neighbours of each flat cell index, for grids too large for a full table.
+    i, j = np.divmod(cells, grid_size)
+    return np.stack([((i + dx) % grid_size) * grid_size + (j + dy) % grid_size for dx, dy in DIRECTIONS], axis=1)
+
+
+def cell_classes(cells, grid_size):
+    # (i + 2j) mod 5 tiles the torus with disjoint von Neumann neighbourhoods, so agents of one
+    # class can all act at once without competing for the same cell.
+    i, j = np.divmod(cells, grid_size)
+    return (i + 2 * j) % 5
+
+
+def independent_classes(grid_size):
+    assert grid_size % 5 == 0, "grid size must be a multiple of 5"
+    colouring = cell_classes(np.arange(grid_size * grid_size), grid_size)
+    return [np.flatnonzero(colouring == c) for c in range(5)]
+
+
+def direction_masks(options):
+    # Packs each row of four flags into a 4-bit mask. Viewed as a little-endian uint32 the row holds one flag per
+    # byte, and the multiply moves the flags into bits 24-27 without any carries between them.
+    return ((options.view("<u4")[:, 0] * np.uint32(0x01020408)) >> 24).astype(np.uint8)
+
+
+def choose_directions(masks, rng):
+    # Same as the object engines' adjacent_cells: try the four directions in a random order and take the first
+    # allowed one.
+    return FIRST_OPTION[masks, rng.integers(len(PERMUTATIONS), size=masks.size, dtype=np.uint8)]
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+import pygame
+
+TILE_SIZE = 10
+STATS_COLOR = (255, 255, 0)
+STATS_BACKGROUND = (0, 0, 0)
+
+
+class GridRenderer:
+    # Draws a grid of colour indices (indexed [x, y]) through an 8-bit palette surface scaled by cell_size.
+    # Only the tiles whose cells changed since the previous frame are rescaled and pushed to the display.
+    def __init__(self, screen, grid_size, cell_size, colors, tile_size=TILE_SIZE):
+        assert grid_size % tile_size == 0, "tile size must divide the grid size"
+        self.screen = screen
+        self.grid_size = grid_size
+        self.cell_size = cell_size
+        self.tile_size = tile_size
+        self.cells = pygame.Surface((grid_size, grid_size), depth=8)
+        self.cells.set_palette(colors)
+        self.rgb_cells = pygame.Surface((grid_size, grid_size)).convert()
+        self.canvas = pygame.Surface(screen.get_size()).convert()
+        self.previous = None
+        self.font = pygame.font.Font(None, 20)
+        self.show_stats = True
+        self.stats_rect = None
+        self.frame_ms = 0.0
+
+    def dirty_areas(self, kinds):
+        full = [pygame.Rect(0, 0, self.grid_size, self.grid_size)]
+        if self.previous is None:
+            return full
+        tiles_per_side = self.grid_size // self.tile_size
+        changed = (kinds != self.previous).reshape(tiles_per_side, self.tile_size, tiles_per_side, self.tile_size)
+        tiles = changed.any(axis=(1, 3))
+        if np.count_nonzero(tiles) > tiles.size // 2:
+            return full
+        return [pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size)
+                for x, y in zip(*np.nonzero(tiles))]
+
+    def render(self, kinds, fps, status=""):
+        start = time.perf_counter()
+        areas = self.dirty_areas(kinds)
+        self.previous = kinds.copy()
+
+        updated = []
+        if areas:
+            pygame.surfarray.blit_array(self.cells, kinds)
+            self.rgb_cells.blit(self.cells, (0, 0))
+            for area in areas:
+                target = pygame.Rect(area.x * self.cell_size, area.y * self.cell_size,
+                                     area.w * self.cell_size, area.h * self.cell_size)
+                pygame.transform.scale(self.rgb_cells.subsurface(area), target.size, self.canvas.subsurface(target))
+                self.screen.blit(self.canvas, target, target)
+                updated.append(target)
+
+        if self.stats_rect is not None:
+            self.screen.blit(self.canvas, self.stats_rect, self.stats_rect)
+            updated.append(self.stats_rect)
+            self.stats_rect = None
+        if self.show_stats:
+            text = self.font.render(f"{fps:5.1f} FPS  {self.frame_ms:5.2f} ms/frame  {status}", True, STATS_COLOR,
+                                    STATS_BACKGROUND)
+            self.stats_rect = self.screen.blit(text, (4, 4))
+            updated.append(self.stats_rect)
+
+        pygame.display.update(updated)
+        self.frame_ms = (time.perf_counter() - start) * 1000
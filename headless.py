@@ -0,0 +1,125 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+CHUNK_TICKS = 1024
+
+
+class CountsWriter:
+    # Streams per-tick state counts to disk as a sequence of .npy chunks. Every chunk is a structured array with a
+    # tick column and one int32 column per state, so read_counts() hands back named columns.
+    def __init__(self, path, names, chunk_ticks=CHUNK_TICKS):
+        self.file = open(path, "wb")
+        self.buffer = np.zeros(chunk_ticks, dtype=[("tick", "<i4")] + [(name, "<i4") for name in names])
+        self.size = 0
+        self.chunks = 0
+
+    def append(self, tick, counts):
+        self.buffer[self.size] = (tick, *counts)
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        np.save(self.file, self.buffer[:self.size])
+        self.size = 0
+        self.chunks += 1
+
+    def close(self):
+        if self.size or not self.chunks:
+            self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_counts(path):
+    chunks = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        while f.tell() < size:
+            chunks.append(np.load(f))
+    return np.concatenate(chunks)
+
+
+def replicate_path(out, replicate):
+    out = Path(out)
+    return str(out.with_name(f"{out.stem}_{replicate}{out.suffix}"))
+
+
+def save_replay(path, simulation, **fields):
+    log = {"seed": simulation.seed, "ticks": simulation.ticks, "params": simulation.params}
+    if hasattr(simulation, "engine"):
+        log["engine"] = simulation.engine
+    with open(path, "w") as f:
+        json.dump({**log, **fields}, f, indent=2)
+
+
+def read_replay(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def fast_forward(simulation, ticks):
+    while simulation.ticks < ticks:
+        simulation.tick()
+    return simulation
+
+
+def replicate_seeds(seed, replicates):
+    # A single run uses the given seed as is, so the seed it prints can be passed back with --seed.
+    if replicates == 1:
+        return [seed]
+    return np.random.SeedSequence(seed).generate_state(replicates).tolist()
+
+
+def run_replicate(build, stop, names, seed, max_ticks, path, log_fields=None):
+    sim = build(seed)
+    with CountsWriter(path, names) as writer:
+        writer.append(sim.ticks, sim.counts())
+        while (max_ticks is None or sim.ticks < max_ticks) and not stop(sim):
+            sim.tick()
+            writer.append(sim.ticks, sim.counts())
+    save_replay(f"{path}.replay.json", sim, **(log_fields or {}))
+    result = sim.seed, sim.ticks, [int(count) for count in sim.counts()]
+    if hasattr(sim, "close"):
+        sim.close()
+    return result
+
+
+def run_replicates(build, stop, names, out, seeds, jobs=1, max_ticks=None, log_fields=None):
+    # build(seed) must return a fresh simulation and, like stop(sim), be picklable when jobs > 1.
+    # Each run also leaves a <counts file>.replay.json that --replay turns back into the same run.
+    paths = [out] if len(seeds) == 1 else [replicate_path(out, r) for r in range(len(seeds))]
+    jobs_args = [(build, stop, names, s, max_ticks, path, log_fields) for s, path in zip(seeds, paths)]
+    if jobs == 1 or len(seeds) == 1:
+        results = [run_replicate(*args) for args in jobs_args]
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(run_replicate, *zip(*jobs_args)))
+    return [(path, *result) for path, result in zip(paths, results)]
+
+
+def print_summary(results, names):
+    for path, seed, ticks, counts in results:
+        final = ", ".join(f"{name}={count}" for name, count in zip(names, counts))
+        print(f"{path}: seed={seed} ticks={ticks} {final}")
+
+
+def add_headless_arguments(parser, default_out):
+    parser.add_argument("--headless", action="store_true", help="run without a display and write per-tick counts")
+    parser.add_argument("--ticks", type=int, default=None, help="stop after this many ticks (default: run to the end)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--params", type=json.loads, default={}, help="JSON object overriding simulation params")
+    parser.add_argument("--out", default=default_out, help="counts file; replicates get a _N suffix")
+    parser.add_argument("--replicates", type=int, default=1, help="independent seeded runs")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes for replicates")
+    parser.add_argument("--replay", default=None,
+                        help="replay log (*.replay.json) to rebuild a previous run from its seed and tick count")
@@ -0,0 +1,198 @@
+import argparse
+import mmap
+import time
+
+import numpy as np
+import pygame
+
+from maze import COLORS, EMPTY, END, PATH, START, Maze, eller_rows, last_room, tree_search
+from randomstream import resolve_seed
+
+MAGIC = b"MAZE0001"
+# Fixed header at the start of a maze file; the cells follow as height x width bytes, row by row.
+HEADER = np.dtype([("magic", "S8"), ("height", "<u8"), ("width", "<u8"), ("seed", "<u8"), ("start", "<u8", 2),
+                   ("end", "<u8", 2)])
+CLEAR_ROWS = 1024
+VIEW_WIDTH, VIEW_HEIGHT = 800, 800
+PAN_FRACTION = 4
+
+
+def write_maze(path, height, width, seed=None):
+    # Streams an Eller maze to disk one row at a time, so the maze never has to fit in memory. Start and end are the
+    # top-left and bottom-right rooms.
+    assert height >= 3 and width >= 3, "a maze needs at least 3x3 cells"
+    seed = resolve_seed(seed) % 2 ** 64
+    start, end = (1, 1), last_room(height, width)
+    header = np.array((MAGIC, height, width, seed, start, end), dtype=HEADER)
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        for x, row in enumerate(eller_rows(height, width, seed)):
+            if x == start[0]:
+                row[start[1]] = START
+            if x == end[0]:
+                row[end[1]] = END
+            f.write(row)
+    return seed
+
+
+class MazeFile:
+    # A maze file opened through a memory map. cells indexes like Maze.cells, but only the pages that are touched are
+    # read from disk, so the solvers that keep no per-cell state can run on mazes larger than memory.
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.file = open(path, "r+b" if writable else "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        header = np.frombuffer(self.map[:HEADER.itemsize], dtype=HEADER)[0]
+        assert header["magic"] == MAGIC, f"{path} is not a maze file"
+        self.height, self.width = int(header["height"]), int(header["width"])
+        self.seed = int(header["seed"])
+        self.start, self.end = tuple(header["start"].tolist()), tuple(header["end"].tolist())
+        self.cells = memoryview(self.map)[HEADER.itemsize:]
+        self.steps = (-self.width, self.width, -1, 1)
+        self.writable = writable
+
+    index = Maze.index
+    coords = Maze.coords
+
+    def grid(self):
+        # The cells as a height x width array backed by its own memory map; slicing it reads only the slice.
+        return np.memmap(self.path, dtype=np.uint8, mode="r+" if self.writable else "r", offset=HEADER.itemsize,
+                         shape=(self.height, self.width))
+
+    def close(self):
+        self.cells.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def clear_path(maze):
+    grid = maze.grid()
+    for x in range(0, maze.height, CLEAR_ROWS):
+        rows = grid[x:x + CLEAR_ROWS]
+        rows[rows == PATH] = EMPTY
+    grid.flush()
+
+
+def solve_file(path):
+    # Marks the route from start to end as PATH in the file itself.
+    with MazeFile(path, writable=True) as maze:
+        clear_path(maze)
+        begin = time.perf_counter()
+        route, expanded = tree_search(maze, maze.index(*maze.start), maze.index(*maze.end))
+        seconds = time.perf_counter() - begin
+        for cell in route[1:-1]:
+            maze.cells[cell] = PATH
+        maze.map.flush()
+    return route, expanded, seconds
+
+
+class MazeViewer:
+    # Shows the part of a maze file that fits the window, at a power-of-two zoom: several pixels per cell when
+    # zoomed in, every k-th cell when zoomed out. Only the visible window is read from the file, and only when the
+    # view changes.
+    def __init__(self, maze, size=(VIEW_WIDTH, VIEW_HEIGHT)):
+        self.maze = maze
+        self.grid = maze.grid()
+        self.screen = pygame.display.set_mode(size)
+        self.zoom = 1.0
+        while max(maze.height, maze.width) * self.zoom > max(size):
+            self.zoom /= 2
+        self.top, self.left = 0, 0
+
+    def visible(self):
+        # Rows and columns of the window as (first, last, stride), with the size of one sampled cell in pixels.
+        view_width, view_height = self.screen.get_size()
+        stride = max(1, int(1 / self.zoom))
+        pixels = max(1, int(self.zoom))
+        rows = (self.top, min(self.maze.height, self.top + view_height // pixels * stride), stride)
+        columns = (self.left, min(self.maze.width, self.left + view_width // pixels * stride), stride)
+        return rows, columns, pixels
+
+    def draw(self):
+        (top, bottom, stride), (left, right, _), pixels = self.visible()
+        window = np.ascontiguousarray(self.grid[top:bottom:stride, left:right:stride].T)
+        cells = pygame.Surface(window.shape, depth=8)
+        cells.set_palette(COLORS)
+        pygame.surfarray.blit_array(cells, window)
+        self.screen.fill(COLORS[0])
+        self.screen.blit(pygame.transform.scale(cells, (window.shape[0] * pixels, window.shape[1] * pixels)), (0, 0))
+        pygame.display.flip()
+        pygame.display.set_caption(f"{self.maze.path}: rows {top}-{bottom}, columns {left}-{right}, "
+                                   f"zoom {self.zoom:g}")
+
+    def pan(self, down, right):
+        (top, bottom, _), (left, right_edge, _), _ = self.visible()
+        self.top = min(max(0, self.top + down * max(1, (bottom - top) // PAN_FRACTION)), self.maze.height - 1)
+        self.left = min(max(0, self.left + right * max(1, (right_edge - left) // PAN_FRACTION)), self.maze.width - 1)
+
+    def zoom_by(self, factor):
+        # Keeps the centre of the window in place.
+        (top, bottom, _), (left, right, _), _ = self.visible()
+        centre_x, centre_y = (top + bottom) // 2, (left + right) // 2
+        self.zoom = min(max(self.zoom * factor, 2 ** -20), 32)
+        (top, bottom, _), (left, right, _), _ = self.visible()
+        self.top = max(0, centre_x - (bottom - top) // 2)
+        self.left = max(0, centre_y - (right - left) // 2)
+
+
+def view_file(path):
+    pygame.init()
+    with MazeFile(path) as maze:
+        viewer = MazeViewer(maze)
+        keys = {pygame.K_UP: (-1, 0), pygame.K_DOWN: (1, 0), pygame.K_LEFT: (0, -1), pygame.K_RIGHT: (0, 1)}
+        clock = pygame.time.Clock()
+        viewer.draw()
+        running = True
+        while running:
+            changed = False
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key in keys:
+                        viewer.pan(*keys[event.key])
+                    elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                        viewer.zoom_by(2)
+                    elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                        viewer.zoom_by(0.5)
+                    changed = True
+            if changed:
+                viewer.draw()
+            clock.tick(30)
+        del viewer
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate, solve and view mazes too large for memory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="stream an Eller maze to a file")
+    generate.add_argument("path")
+    generate.add_argument("--height", type=int, default=10001)
+    generate.add_argument("--width", type=int, default=10001)
+    generate.add_argument("--seed", type=int, default=None)
+    solve = commands.add_parser("solve", help="mark the route from start to end in the file")
+    solve.add_argument("path")
+    view = commands.add_parser("view", help="browse the file: arrow keys pan, +/- zoom")
+    view.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "generate" and min(args.height, args.width) < 3:
+        parser.error("--height and --width must be at least 3")
+
+    if args.command == "generate":
+        begin = time.perf_counter()
+        seed = write_maze(args.path, args.height, args.width, args.seed)
+        seconds = time.perf_counter() - begin
+        print(f"{args.path}: {args.height}x{args.width} seed={seed} in {seconds:.1f} s "
+              f"({args.height * args.width / seconds / 1e6:.1f}M cells/s)")
+    elif args.command == "solve":
+        route, expanded, seconds = solve_file(args.path)
+        print(f"{args.path}: route of {len(route)} cells, {expanded} expanded in {seconds:.1f} s")
+    else:
+        view_file(args.path)
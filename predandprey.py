@@ -1,13 +1,22 @@
-import random
+import argparse
+from functools import partial
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pygame
 
+from gridarrays import choose_directions, direction_masks, independent_classes, neighbour_table
+from gridview import GridRenderer
+from headless import add_headless_arguments, fast_forward, print_summary, read_replay, replicate_seeds, run_replicates
+from randomstream import RandomStream, resolve_seed
+from stepper import Stepper
+
 # Constants
 GRID_SIZE = 100
 CELL_SIZE = 6
 WIDTH, HEIGHT = GRID_SIZE * CELL_SIZE, GRID_SIZE * CELL_SIZE
+TICK_FPS = 10
+DISPLAY_FPS = 60
 
 # Pygame Colors
 EMPTY = (65, 25, 0)
@@ -15,6 +24,17 @@ GREEN = (100, 170, 0)
 SHEEP = (220, 200, 200)
 WOLF = (200, 0, 0)
 
+DEFAULT_PARAMS = {'sheep_max_hunger': 44,
+                  'wolf_max_hunger': 35,
+                  'sheep_reproduction_rate': 0.051,
+                  'wolf_reproduction_rate': 0.017,
+                  'grass_growth_rate': 0.013}
+
+# Cell kinds
+KIND_EMPTY, KIND_GRASS, KIND_SHEEP, KIND_WOLF = range(4)
+COLORS = [EMPTY, GREEN, SHEEP, WOLF]
+KIND_NAMES = ["empty", "grass", "sheep", "wolf"]
+
 
 class Entity:
     def __init__(self, x, y, color):
@@ -22,20 +42,47 @@ class Entity:
         self.y = y
         self.color = color
 
-    def tick(self, grid, params):
+    def tick(self, grid, params, population, rng):
         pass
 
 
+class Population:
+    def __init__(self, grid):
+        self.counts = self.recount(grid)
+
+    @staticmethod
+    def recount(grid):
+        counts = [0] * len(COLORS)
+        for row in grid:
+            for entity in row:
+                counts[entity.kind] += 1
+        return counts
+
+    def place(self, grid, x, y, entity):
+        self.counts[grid[x, y].kind] -= 1
+        self.counts[entity.kind] += 1
+        grid[x, y] = entity
+
+    def check(self, grid):
+        expected = self.recount(grid)
+        if self.counts != expected:
+            raise RuntimeError(f"Population counters {self.counts} do not match grid recount {expected}")
+
+
 class Empty(Entity):
+    kind = KIND_EMPTY
+
     def __init__(self, x, y):
         super().__init__(x, y, EMPTY)
 
-    def tick(self, grid, params):
-        if random.random() < params["grass_growth_rate"]:
-            grid[self.x, self.y] = Grass(self.x, self.y)
+    def tick(self, grid, params, population, rng):
+        if rng.random() < params["grass_growth_rate"]:
+            population.place(grid, self.x, self.y, Grass(self.x, self.y))
 
 
 class Grass(Entity):
+    kind = KIND_GRASS
+
     def __init__(self, x, y):
         super().__init__(x, y, GREEN)
 
@@ -48,54 +95,54 @@ class Animal(Entity):
         self.eats_cls = eats_cls
         self.reproduction_rate = reproduction_rate
 
-    def random_move(self, grid):
-        for new_x, new_y in self.adjacent_cells():
+    def random_move(self, grid, population, rng):
+        for new_x, new_y in self.adjacent_cells(rng):
             if isinstance(grid[new_x, new_y], Empty):
-                self.move(grid, new_x, new_y)
+                self.move(grid, population, new_x, new_y)
                 break
 
-    def move(self, grid, new_x, new_y):
-        grid[new_x, new_y] = self
-        grid[self.x, self.y] = Empty(self.x, self.y)
+    def move(self, grid, population, new_x, new_y):
+        population.place(grid, new_x, new_y, self)
+        population.place(grid, self.x, self.y, Empty(self.x, self.y))
         self.x, self.y = new_x, new_y
 
-    def adjacent_cells(self):
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        random.shuffle(directions)
-        for dx, dy in directions:
+    def adjacent_cells(self, rng):
+        for dx, dy in rng.directions():
             yield (self.x + dx) % GRID_SIZE, (self.y + dy) % GRID_SIZE
 
-    def attempt_eat(self, grid):
-        for new_x, new_y in self.adjacent_cells():
+    def attempt_eat(self, grid, population, rng):
+        for new_x, new_y in self.adjacent_cells(rng):
             if isinstance(grid[new_x, new_y], self.eats_cls):
                 self.hunger = 0
-                self.move(grid, new_x, new_y)
+                self.move(grid, population, new_x, new_y)
                 return True
         return False
 
-    def reproduce(self, grid):
-        if random.random() < self.reproduction_rate:
-            for new_x, new_y in self.adjacent_cells():
+    def reproduce(self, grid, population, rng):
+        if rng.random() < self.reproduction_rate:
+            for new_x, new_y in self.adjacent_cells(rng):
                 if isinstance(grid[new_x, new_y], Empty):
-                    grid[new_x, new_y] = self.create_child(new_x, new_y)
+                    population.place(grid, new_x, new_y, self.create_child(new_x, new_y))
                     break
 
     def create_child(self, x, y):
         raise NotImplementedError()
 
-    def increase_hunger(self, grid):
+    def increase_hunger(self, grid, population):
         self.hunger += 1
         if self.hunger >= self.max_hunger:
-            grid[self.x, self.y] = Empty(self.x, self.y)
+            population.place(grid, self.x, self.y, Empty(self.x, self.y))
 
-    def tick(self, grid, params):
-        if not self.attempt_eat(grid):
-            self.random_move(grid)
-        self.reproduce(grid)
-        self.increase_hunger(grid)
+    def tick(self, grid, params, population, rng):
+        if not self.attempt_eat(grid, population, rng):
+            self.random_move(grid, population, rng)
+        self.reproduce(grid, population, rng)
+        self.increase_hunger(grid, population)
 
 
 class Sheep(Animal):
+    kind = KIND_SHEEP
+
     def __init__(self, x, y, params):
         super().__init__(x, y, 0, params["sheep_max_hunger"], Grass, params["sheep_reproduction_rate"], SHEEP)
         self.params = params
@@ -105,6 +152,8 @@ class Sheep(Animal):
 
 
 class Wolf(Animal):
+    kind = KIND_WOLF
+
     def __init__(self, x, y, params):
         super().__init__(x, y, 0, params["wolf_max_hunger"], Sheep, params["wolf_reproduction_rate"], WOLF)
         self.params = params
@@ -114,17 +163,24 @@ class Wolf(Animal):
 
 
 class Simulation:
-    def __init__(self, params):
+    engine = "object"
+
+    def __init__(self, params, seed=None, debug=False):
         self.params = params
+        self.debug = debug
+        self.rng = RandomStream(seed)
+        self.seed = self.rng.seed
+        self.ticks = 0
         self.grid = np.array([[Empty(i, j) for j in range(GRID_SIZE)] for i in range(GRID_SIZE)])
         self.populate()
+        self.population = Population(self.grid)
         self.sheep_population_history = []
         self.wolf_population_history = []
 
     def populate(self):
         for i in range(GRID_SIZE):
             for j in range(GRID_SIZE):
-                rnd = random.random()
+                rnd = self.rng.random()
                 if rnd < 0.1:
                     self.grid[i, j] = Grass(i, j)
                 elif rnd < 0.18:
@@ -135,19 +191,51 @@ class Simulation:
     def tick(self):
         for row in self.grid:
             for entity in row:
-                entity.tick(self.grid, self.params)
+                entity.tick(self.grid, self.params, self.population, self.rng)
+        if self.debug:
+            self.population.check(self.grid)
+        self.ticks += 1
         self.record_population()
 
     def record_population(self):
-        sheep_count = sum(isinstance(entity, Sheep) for row in self.grid for entity in row)
-        wolf_count = sum(isinstance(entity, Wolf) for row in self.grid for entity in row)
-        self.sheep_population_history.append(sheep_count)
-        self.wolf_population_history.append(wolf_count)
+        self.sheep_population_history.append(self.population.counts[KIND_SHEEP])
+        self.wolf_population_history.append(self.population.counts[KIND_WOLF])
 
     def has_both_species(self):
-        sheep_present = any(isinstance(entity, Sheep) for row in self.grid for entity in row)
-        wolf_present = any(isinstance(entity, Wolf) for row in self.grid for entity in row)
-        return sheep_present and wolf_present
+        return self.population.counts[KIND_SHEEP] > 0 and self.population.counts[KIND_WOLF] > 0
+
+    def counts(self):
+        return list(self.population.counts)
+
+    def kinds(self):
+        return np.array([[entity.kind for entity in row] for row in self.grid], dtype=np.uint8)
+
+    def state(self):
+        hunger = np.array([[getattr(entity, "hunger", 0) for entity in row] for row in self.grid], dtype=np.int16)
+        return {"engine": self.engine, "params": self.params, "seed": self.seed, "ticks": self.ticks,
+                "rng": self.rng.get_state(), "kind": self.kinds().ravel(), "hunger": hunger.ravel()}
+
+    @classmethod
+    def from_state(cls, state):
+        simulation = cls(state["params"], state["seed"])
+        simulation.rng.set_state(state["rng"])
+        simulation.ticks = state["ticks"]
+        create = [lambda i, j: Empty(i, j), lambda i, j: Grass(i, j),
+                  lambda i, j: Sheep(i, j, simulation.params), lambda i, j: Wolf(i, j, simulation.params)]
+        kinds = np.asarray(state["kind"]).reshape(GRID_SIZE, GRID_SIZE)
+        hunger = np.asarray(state["hunger"]).reshape(GRID_SIZE, GRID_SIZE)
+        for i in range(GRID_SIZE):
+            for j in range(GRID_SIZE):
+                entity = create[kinds[i, j]](i, j)
+                if isinstance(entity, Animal):
+                    entity.hunger = int(hunger[i, j])
+                simulation.grid[i, j] = entity
+        simulation.population = Population(simulation.grid)
+        return simulation
+
+    def reseed(self, seed):
+        self.rng = RandomStream(seed)
+        self.seed = self.rng.seed
 
     def plot_population(self):
         plt.figure(figsize=(10, 5))
@@ -161,23 +249,143 @@ class Simulation:
         plt.show()
 
 
+NEIGHBOURS = neighbour_table(GRID_SIZE)
+CLASS_CELLS = independent_classes(GRID_SIZE)
+
+
+class ArraySimulation:
+    engine = "array"
+
+    def __init__(self, params, seed=None):
+        self.params = params
+        self.seed = resolve_seed(seed)
+        self.rng = np.random.default_rng(self.seed)
+        self.ticks = 0
+        self.kind = np.zeros(GRID_SIZE * GRID_SIZE, dtype=np.uint8)
+        self.hunger = np.zeros(GRID_SIZE * GRID_SIZE, dtype=np.int16)
+        self.max_hunger = np.array([0, 0, params["sheep_max_hunger"], params["wolf_max_hunger"]], dtype=np.int16)
+        self.reproduction_rate = np.array([0, 0, params["sheep_reproduction_rate"], params["wolf_reproduction_rate"]])
+        self.food = np.array([KIND_EMPTY, KIND_EMPTY, KIND_GRASS, KIND_SHEEP], dtype=np.uint8)
+        self.populate()
+        self.sheep_population_history = []
+        self.wolf_population_history = []
+
+    def populate(self):
+        rnd = self.rng.random(self.kind.size)
+        self.kind[rnd < 0.19] = KIND_WOLF
+        self.kind[rnd < 0.18] = KIND_SHEEP
+        self.kind[rnd < 0.1] = KIND_GRASS
+
+    def tick(self):
+        self.grow_grass()
+        self.move_animals()
+        self.reproduce_animals()
+        self.increase_hunger()
+        self.ticks += 1
+        self.record_population()
+
+    def grow_grass(self):
+        grows = (self.kind == KIND_EMPTY) & (self.rng.random(self.kind.size) < self.params["grass_growth_rate"])
+        self.kind[grows] = KIND_GRASS
+
+    def move_animals(self):
+        acted = np.zeros(self.kind.size, dtype=bool)
+        for c in self.rng.permutation(len(CLASS_CELLS)):
+            cells = CLASS_CELLS[c]
+            cells = cells[(self.kind[cells] >= KIND_SHEEP) & ~acted[cells]]
+            kind = self.kind[cells]
+            neighbours = NEIGHBOURS[cells]
+            neighbour_kind = self.kind[neighbours]
+            food = direction_masks(neighbour_kind == self.food[kind][:, None])
+            masks = np.where(food != 0, food, direction_masks(neighbour_kind == KIND_EMPTY))
+            moves = masks != 0
+
+            src = cells[moves]
+            dest = neighbours[moves, choose_directions(masks[moves], self.rng)]
+            self.hunger[dest] = np.where(food[moves] != 0, 0, self.hunger[src])
+            self.kind[dest] = kind[moves]
+            self.kind[src] = KIND_EMPTY
+            self.hunger[src] = 0
+            acted[dest] = True
+
+    def reproduce_animals(self):
+        parents = (self.kind >= KIND_SHEEP) & (self.rng.random(self.kind.size) < self.reproduction_rate[self.kind])
+        for c in self.rng.permutation(len(CLASS_CELLS)):
+            cells = CLASS_CELLS[c]
+            cells = cells[parents[cells]]
+            neighbours = NEIGHBOURS[cells]
+            masks = direction_masks(self.kind[neighbours] == KIND_EMPTY)
+            births = masks != 0
+
+            children = neighbours[births, choose_directions(masks[births], self.rng)]
+            self.kind[children] = self.kind[cells[births]]
+            self.hunger[children] = 0
+
+    def increase_hunger(self):
+        animals = self.kind >= KIND_SHEEP
+        self.hunger += animals
+        starved = animals & (self.hunger >= self.max_hunger[self.kind])
+        self.kind[starved] = KIND_EMPTY
+        self.hunger[starved] = 0
+
+    def record_population(self):
+        counts = self.counts()
+        self.sheep_population_history.append(int(counts[KIND_SHEEP]))
+        self.wolf_population_history.append(int(counts[KIND_WOLF]))
+
+    def has_both_species(self):
+        counts = self.counts()
+        return counts[KIND_SHEEP] > 0 and counts[KIND_WOLF] > 0
+
+    def counts(self):
+        return np.bincount(self.kind, minlength=len(COLORS))
+
+    def kinds(self):
+        return self.kind.reshape(GRID_SIZE, GRID_SIZE)
+
+    def state(self):
+        return {"engine": self.engine, "params": self.params, "seed": self.seed, "ticks": self.ticks,
+                "rng": self.rng.bit_generator.state, "kind": self.kind.copy(), "hunger": self.hunger.copy()}
+
+    @classmethod
+    def from_state(cls, state):
+        simulation = cls(state["params"], state["seed"])
+        simulation.rng.bit_generator.state = state["rng"]
+        simulation.ticks = state["ticks"]
+        simulation.kind[:] = state["kind"]
+        simulation.hunger[:] = state["hunger"]
+        return simulation
+
+    def reseed(self, seed):
+        self.seed = resolve_seed(seed)
+        self.rng = np.random.default_rng(self.seed)
+
+    plot_population = Simulation.plot_population
+
+
 class App:
-    def __init__(self, simulation):
+    def __init__(self, simulation, threaded=False, ticks_per_second=None):
         pygame.init()
         self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
         pygame.display.set_caption("Animal Simulation")
         self.simulation = simulation
         self.clock = pygame.time.Clock()
         self.continuous_mode = False
+        self.renderer = GridRenderer(self.screen, GRID_SIZE, CELL_SIZE, COLORS)
+        self.stepper = Stepper(simulation, ticks_per_second) if threaded else None
 
     def render(self):
-        self.screen.fill(EMPTY)
-        for i in range(GRID_SIZE):
-            for j in range(GRID_SIZE):
-                entity = self.simulation.grid[i, j]
-                pygame.draw.rect(self.screen, entity.color,
-                                 pygame.Rect(i * CELL_SIZE, j * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-        pygame.display.flip()
+        if self.stepper is None:
+            self.renderer.render(self.simulation.kinds(), self.clock.get_fps())
+        else:
+            self.renderer.render(self.stepper.latest(), self.clock.get_fps(),
+                                 f"tick {self.stepper.ticks}  {self.stepper.measured_tps:.0f} ticks/s")
+
+    def step(self):
+        if self.stepper is None:
+            self.simulation.tick()
+        else:
+            self.stepper.step()
 
     def run(self):
         running = True
@@ -187,26 +395,82 @@ class App:
                     running = False
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_SPACE:
-                        self.simulation.tick()
+                        self.step()
                     elif event.key == pygame.K_RETURN:
                         self.continuous_mode = not self.continuous_mode
+                        if self.stepper is not None:
+                            self.stepper.set_running(self.continuous_mode)
+                    elif event.key == pygame.K_f:
+                        self.renderer.show_stats = not self.renderer.show_stats
                     elif event.key == pygame.K_p:
                         self.simulation.plot_population()
 
-            if self.continuous_mode:
+            if self.continuous_mode and self.stepper is None:
                 self.simulation.tick()
 
             self.render()
-            self.clock.tick(10)
+            self.clock.tick(TICK_FPS if self.stepper is None else DISPLAY_FPS)
 
+        if self.stepper is not None:
+            self.stepper.stop()
         pygame.quit()
 
 
+ENGINES = {Simulation.engine: Simulation, ArraySimulation.engine: ArraySimulation}
+
+
+def build_simulation(engine, params, seed=None, resume=None, checkpoint=None, checkpoint_every=100):
+    # predandprey_checkpoint imports this module, so it is only imported once a checkpoint is involved.
+    if resume:
+        from predandprey_checkpoint import load_checkpoint
+        simulation = load_checkpoint(resume)
+    else:
+        simulation = ENGINES[engine](params, seed=seed)
+    if checkpoint:
+        from predandprey_checkpoint import Checkpointed
+        simulation = Checkpointed(simulation, checkpoint, checkpoint_every)
+    return simulation
+
+
+def extinct(simulation):
+    return not simulation.has_both_species()
+
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--engine", choices=ENGINES, default="object",
+                        help="Simulation (one object per cell) or the NumPy ArraySimulation")
+    parser.add_argument("--threaded", action="store_true",
+                        help="step the simulation on a background thread, independent of the display rate")
+    parser.add_argument("--tps", type=float, default=None,
+                        help="target ticks per second in threaded mode (default: as fast as possible)")
+    add_headless_arguments(parser, "predandprey_counts.bin")
+    parser.add_argument("--checkpoint", default=None, help="memory-mapped checkpoint file to keep up to date")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="ticks between checkpoint writes")
+    parser.add_argument("--resume", default=None, help="checkpoint file to continue from")
+    args = parser.parse_args()
+    if args.replicates > 1 and (args.checkpoint or args.resume):
+        parser.error("--checkpoint and --resume work on a single run")
+    return args
+
+
 if __name__ == "__main__":
-    simulation = Simulation({'sheep_max_hunger': 44,
-                             'wolf_max_hunger': 35,
-                             'sheep_reproduction_rate': 0.051,
-                             'wolf_reproduction_rate': 0.017,
-                             'grass_growth_rate': 0.013})
-    app = App(simulation)
-    app.run()
+    args = parse_args("Predator and prey simulation.")
+    params = {**DEFAULT_PARAMS, **args.params}
+    seeds, replay_ticks = replicate_seeds(args.seed, args.replicates), 0
+    if args.replay:
+        log = read_replay(args.replay)
+        args.engine, params, seeds, replay_ticks = log["engine"], log["params"], [log["seed"]], log["ticks"]
+
+    build = partial(build_simulation, args.engine, params, resume=args.resume, checkpoint=args.checkpoint,
+                    checkpoint_every=args.checkpoint_every)
+    if args.headless:
+        results = run_replicates(build, extinct, KIND_NAMES, args.out, seeds, args.jobs,
+                                 args.ticks or replay_ticks or None)
+        print_summary(results, KIND_NAMES)
+    else:
+        simulation = fast_forward(build(seeds[0]), replay_ticks)
+        app = App(simulation, args.threaded, args.tps)
+        app.run()
+        if args.checkpoint:
+            simulation.save()
@@ -0,0 +1,144 @@
+import numpy as np
+
+from predandprey import (CLASS_CELLS, GRID_SIZE, KIND_EMPTY, KIND_GRASS, KIND_SHEEP, KIND_WOLF, NEIGHBOURS,
+                         choose_directions, direction_masks)
+
+CELLS = GRID_SIZE * GRID_SIZE
+
+
+class BatchSimulation:
+    # Advances many independent ArraySimulation-style worlds in one stacked (worlds, cells) array. Rows of worlds
+    # that lost a species are dropped, so the cost of a tick follows the number of worlds still alive.
+    def __init__(self, params_list, seed=None):
+        self.params_list = params_list
+        self.rng = np.random.default_rng(seed)
+        self.worlds = np.arange(len(params_list))
+        self.kind = np.zeros((len(params_list), CELLS), dtype=np.uint8)
+        self.hunger = np.zeros((len(params_list), CELLS), dtype=np.int16)
+        self.sheep_max_hunger = np.array([p["sheep_max_hunger"] for p in params_list], dtype=np.int16)
+        self.wolf_max_hunger = np.array([p["wolf_max_hunger"] for p in params_list], dtype=np.int16)
+        self.sheep_reproduction_rate = np.array([p["sheep_reproduction_rate"] for p in params_list], dtype=np.float32)
+        self.wolf_reproduction_rate = np.array([p["wolf_reproduction_rate"] for p in params_list], dtype=np.float32)
+        self.grass_growth_rate = np.array([p["grass_growth_rate"] for p in params_list], dtype=np.float32)
+        self.food = np.array([KIND_EMPTY, KIND_EMPTY, KIND_GRASS, KIND_SHEEP], dtype=np.uint8)
+        self.ticks = 0
+        self.extinction_ticks = np.full(len(params_list), -1)
+        self.sheep_population_history = [[] for _ in params_list]
+        self.wolf_population_history = [[] for _ in params_list]
+        self.class_cells = []
+        self.populate()
+        self.retire_extinct()
+        self.stack_classes()
+
+    def populate(self):
+        rnd = self.rng.random(self.kind.shape, dtype=np.float32)
+        self.kind[rnd < 0.19] = KIND_WOLF
+        self.kind[rnd < 0.18] = KIND_SHEEP
+        self.kind[rnd < 0.1] = KIND_GRASS
+
+    def has_active_worlds(self):
+        return self.worlds.size > 0
+
+    def tick(self):
+        self.grow_grass()
+        self.move_animals()
+        self.reproduce_animals()
+        self.increase_hunger()
+        self.ticks += 1
+        self.record_population()
+        self.retire_extinct()
+
+    def run(self, max_ticks=1000):
+        while self.has_active_worlds() and self.ticks <= max_ticks:
+            self.tick()
+        self.retire(self.worlds, self.ticks)
+        return self.extinction_ticks
+
+    def stack_classes(self):
+        # Flat cell indices of every colour class across all live worlds, with their neighbours stored as offsets
+        # so a pass never has to split a flat index back into (world, cell).
+        offsets = np.arange(self.worlds.size)[:, None] * CELLS
+        self.class_cells = [((offsets + cells).reshape(-1),
+                             np.tile((NEIGHBOURS[cells] - cells[:, None]).astype(np.int16), (self.worlds.size, 1)))
+                            for cells in CLASS_CELLS]
+
+    def grow_grass(self):
+        rnd = self.rng.random(self.kind.shape, dtype=np.float32)
+        grows = (self.kind == KIND_EMPTY) & (rnd < self.grass_growth_rate[:, None])
+        self.kind[grows] = KIND_GRASS
+
+    def move_animals(self):
+        kind = self.kind.reshape(-1)
+        hunger = self.hunger.reshape(-1)
+        acted = np.zeros(kind.size, dtype=bool)
+        for c in self.rng.permutation(len(self.class_cells)):
+            cells, deltas = self.class_cells[c]
+            animals = np.flatnonzero((kind[cells] >= KIND_SHEEP) & ~acted[cells])
+            cells, deltas = cells[animals], deltas[animals]
+            cell_kind = kind[cells]
+            neighbours = cells[:, None] + deltas
+            neighbour_kind = kind[neighbours]
+            food = direction_masks(neighbour_kind == self.food[cell_kind][:, None])
+            masks = np.where(food != 0, food, direction_masks(neighbour_kind == KIND_EMPTY))
+            moves = masks != 0
+
+            src = cells[moves]
+            dest = neighbours[moves, choose_directions(masks[moves], self.rng)]
+            hunger[dest] = np.where(food[moves] != 0, 0, hunger[src])
+            kind[dest] = cell_kind[moves]
+            kind[src] = KIND_EMPTY
+            hunger[src] = 0
+            acted[dest] = True
+
+    def reproduce_animals(self):
+        rates = np.where(self.kind == KIND_SHEEP, self.sheep_reproduction_rate[:, None],
+                         np.where(self.kind == KIND_WOLF, self.wolf_reproduction_rate[:, None], 0))
+        parents = (self.rng.random(self.kind.shape, dtype=np.float32) < rates).reshape(-1)
+        kind = self.kind.reshape(-1)
+        hunger = self.hunger.reshape(-1)
+        for c in self.rng.permutation(len(self.class_cells)):
+            cells, deltas = self.class_cells[c]
+            selected = np.flatnonzero(parents[cells])
+            cells = cells[selected]
+            neighbours = cells[:, None] + deltas[selected]
+            masks = direction_masks(kind[neighbours] == KIND_EMPTY)
+            births = masks != 0
+
+            children = neighbours[births, choose_directions(masks[births], self.rng)]
+            kind[children] = kind[cells[births]]
+            hunger[children] = 0
+
+    def increase_hunger(self):
+        animals = self.kind >= KIND_SHEEP
+        self.hunger += animals
+        max_hunger = np.where(self.kind == KIND_SHEEP, self.sheep_max_hunger[:, None], self.wolf_max_hunger[:, None])
+        starved = animals & (self.hunger >= max_hunger)
+        self.kind[starved] = KIND_EMPTY
+        self.hunger[starved] = 0
+
+    def record_population(self):
+        for world, sheep, wolves in zip(self.worlds, *self.counts()):
+            self.sheep_population_history[world].append(int(sheep))
+            self.wolf_population_history[world].append(int(wolves))
+
+    def counts(self):
+        return np.count_nonzero(self.kind == KIND_SHEEP, axis=1), np.count_nonzero(self.kind == KIND_WOLF, axis=1)
+
+    def retire_extinct(self):
+        sheep, wolves = self.counts()
+        self.retire(self.worlds[(sheep == 0) | (wolves == 0)], self.ticks)
+
+    def retire(self, worlds, ticks):
+        if len(worlds) == 0:
+            return
+        self.extinction_ticks[worlds] = ticks
+        keep = ~np.isin(self.worlds, worlds)
+        self.worlds = self.worlds[keep]
+        self.kind = self.kind[keep]
+        self.hunger = self.hunger[keep]
+        self.sheep_max_hunger = self.sheep_max_hunger[keep]
+        self.wolf_max_hunger = self.wolf_max_hunger[keep]
+        self.sheep_reproduction_rate = self.sheep_reproduction_rate[keep]
+        self.wolf_reproduction_rate = self.wolf_reproduction_rate[keep]
+        self.grass_growth_rate = self.grass_growth_rate[keep]
+        self.stack_classes()
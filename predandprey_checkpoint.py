@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from predandprey import ENGINES, GRID_SIZE
+
+MAGIC = b"PPCKPT1"
+META_SIZE = 8192
+HISTORY_CAPACITY = 4096
+HEADER = np.dtype([("magic", "S8"), ("active", "<u4"), ("grid_size", "<u4"), ("history_capacity", "<u8")])
+CELLS = GRID_SIZE * GRID_SIZE
+SLOT = np.dtype([("ticks", "<u8"), ("history_length", "<u8"), ("meta", f"S{META_SIZE}"),
+                 ("kind", "u1", (CELLS,)), ("hunger", "<i2", (CELLS,))])
+
+
+def file_size(history_capacity):
+    return HEADER.itemsize + 2 * SLOT.itemsize + history_capacity * 2 * 4
+
+
+def map_regions(memmap, history_capacity):
+    header = np.ndarray((), dtype=HEADER, buffer=memmap, offset=0)
+    slots = np.ndarray(2, dtype=SLOT, buffer=memmap, offset=HEADER.itemsize)
+    history = np.ndarray((history_capacity, 2), dtype="<i4", buffer=memmap,
+                         offset=HEADER.itemsize + 2 * SLOT.itemsize)
+    return header, slots, history
+
+
+class Checkpointer:
+    # Keeps a predator/prey checkpoint in a memory-mapped file: a header, two state slots and the sheep/wolf history.
+    # Each save fills the inactive slot and then flips the header, so a crash mid-write leaves the previous
+    # checkpoint intact. The history is append-only, so only the ticks since the last save are written.
+    def __init__(self, path, history_capacity=HISTORY_CAPACITY):
+        self.path = path
+        self.history_capacity = history_capacity
+        self.memmap = None
+        self.saved_length = 0
+
+    def save(self, simulation):
+        length = len(simulation.sheep_population_history)
+        if self.memmap is None or length > self.history_capacity:
+            self.create(simulation)
+            return
+
+        self.write_history(simulation, length)
+        slot = 1 - int(self.header["active"])
+        self.write_slot(slot, simulation, length)
+        self.memmap.flush()
+        self.header["active"] = slot
+        self.memmap.flush()
+
+    def create(self, simulation):
+        # A new or grown file is written in full under a temporary name and renamed over the old one.
+        length = len(simulation.sheep_population_history)
+        while self.history_capacity < length:
+            self.history_capacity *= 2
+        tmp_path = f"{self.path}.tmp"
+        self.memmap = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=file_size(self.history_capacity))
+        self.header, self.slots, self.history = map_regions(self.memmap, self.history_capacity)
+        self.header["magic"] = MAGIC
+        self.header["grid_size"] = GRID_SIZE
+        self.header["history_capacity"] = self.history_capacity
+        self.saved_length = 0
+        self.write_history(simulation, length)
+        self.write_slot(0, simulation, length)
+        self.header["active"] = 0
+        self.memmap.flush()
+        os.replace(tmp_path, self.path)
+
+    def write_history(self, simulation, length):
+        self.history[self.saved_length:length, 0] = simulation.sheep_population_history[self.saved_length:]
+        self.history[self.saved_length:length, 1] = simulation.wolf_population_history[self.saved_length:]
+        self.saved_length = length
+
+    def write_slot(self, slot, simulation, length):
+        state = simulation.state()
+        meta = {key: state[key] for key in ("engine", "params", "seed", "rng")}
+        self.slots["ticks"][slot] = state["ticks"]
+        self.slots["history_length"][slot] = length
+        self.slots["meta"][slot] = json.dumps(meta).encode()
+        self.slots["kind"][slot] = state["kind"]
+        self.slots["hunger"][slot] = state["hunger"]
+
+
+class Checkpointed:
+    # Wraps a simulation so that whoever drives tick() (App, Stepper, headless runner) saves a checkpoint every
+    # `every` ticks.
+    def __init__(self, simulation, path, every):
+        self.simulation = simulation
+        self.checkpointer = Checkpointer(path)
+        self.every = every
+
+    def tick(self):
+        self.simulation.tick()
+        if self.simulation.ticks % self.every == 0:
+            self.save()
+
+    def save(self):
+        self.checkpointer.save(self.simulation)
+
+    def __getattr__(self, name):
+        return getattr(self.simulation, name)
+
+
+def load_checkpoint(path):
+    memmap = np.memmap(path, dtype=np.uint8, mode="r")
+    header = np.ndarray((), dtype=HEADER, buffer=memmap, offset=0)
+    if header["magic"] != MAGIC or header["grid_size"] != GRID_SIZE:
+        raise ValueError(f"{path} is not a checkpoint for a {GRID_SIZE}x{GRID_SIZE} grid")
+    _, slots, history = map_regions(memmap, int(header["history_capacity"]))
+    slot = slots[int(header["active"])]
+
+    state = json.loads(bytes(slot["meta"]))
+    state.update(ticks=int(slot["ticks"]), kind=slot["kind"], hunger=slot["hunger"])
+    simulation = ENGINES[state["engine"]].from_state(state)
+    length = int(slot["history_length"])
+    simulation.sheep_population_history = history[:length, 0].tolist()
+    simulation.wolf_population_history = history[:length, 1].tolist()
+    return simulation
+
+
+def run_branch(path, seed, ticks):
+    simulation = load_checkpoint(path)
+    simulation.reseed(seed)
+    start = simulation.ticks
+    while simulation.has_both_species() and simulation.ticks - start < ticks:
+        simulation.tick()
+    return simulation.ticks - start, [int(count) for count in simulation.counts()]
+
+
+def fork(path, branches, ticks, jobs=None, seed=None):
+    # Continues one saved world `branches` times with different seeds, in parallel.
+    seeds = np.random.SeedSequence(seed).generate_state(branches).tolist()
+    with ProcessPoolExecutor(jobs) as pool:
+        results = list(pool.map(run_branch, [path] * branches, seeds, [ticks] * branches))
+    return [(branch_seed, survived, counts) for branch_seed, (survived, counts) in zip(seeds, results)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many continuations of a saved predator/prey world.")
+    parser.add_argument("checkpoint")
+    parser.add_argument("--branches", type=int, default=8)
+    parser.add_argument("--ticks", type=int, default=1000, help="maximum ticks per branch")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    for branch_seed, survived, counts in fork(args.checkpoint, args.branches, args.ticks, args.jobs, args.seed):
+        print(f"seed={branch_seed} survived={survived} counts={counts}")
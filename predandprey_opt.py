@@ -1,21 +1,88 @@
+import argparse
+import os
+import statistics
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+import numpy as np
 import optuna
+from optuna.storages import JournalStorage
+from optuna.storages.journal import JournalFileBackend
+from optuna.trial import TrialState
+
+from predandprey import ENGINES
+from predandprey_batch import BatchSimulation
+
+MAX_TICKS = 1000
+REPORT_EVERY = 50
+
+AGGREGATES = {"mean": statistics.mean, "median": statistics.median}
+PRUNERS = {
+    "none": optuna.pruners.NopPruner,
+    "median": lambda: optuna.pruners.MedianPruner(n_startup_trials=10, n_warmup_steps=2 * REPORT_EVERY),
+    "hyperband": lambda: optuna.pruners.HyperbandPruner(min_resource=REPORT_EVERY, max_resource=MAX_TICKS),
+}
+
+
+def population_balance(sim):
+    sheep, wolves = sim.sheep_population_history[-1], sim.wolf_population_history[-1]
+    return min(sheep, wolves) / max(sheep + wolves, 1)
+
 
-from predandprey import Simulation
+def predict_extinction(history, window=50, threshold=30):
+    # Fits exponential decay to the tail of a small population and returns the ticks left until it dies out,
+    # or None while the species is not clearly collapsing. The decline has to hold over two consecutive windows,
+    # so an ordinary trough of the predator/prey cycle does not count as a collapse.
+    if len(history) < 2 * window or history[-1] > threshold:
+        return None
+    ticks = np.arange(window)
+    earlier = np.log1p(history[-2 * window:-window])
+    recent = np.log1p(history[-window:])
+    slope = np.polyfit(ticks, recent, 1)[0]
+    if slope >= 0 or np.polyfit(ticks, earlier, 1)[0] >= 0:
+        return None
+    return int(recent[-1] / -slope)
 
 
-def run_simulation(params):
-    sim = Simulation(params)
+def run_simulation(params, seed=None, trial=None, report_every=REPORT_EVERY, predict=True, engine="object"):
+    sim = ENGINES[engine](params, seed=seed)
     ticks = 0
     while sim.has_both_species():
         sim.tick()
         ticks += 1
-        if ticks > 1000:
+        if ticks > MAX_TICKS:
             break
+        if ticks % report_every == 0:
+            if trial is not None:
+                trial.report(population_balance(sim), ticks)
+                if trial.should_prune():
+                    raise optuna.TrialPruned()
+            if predict:
+                remaining = [predict_extinction(sim.sheep_population_history),
+                             predict_extinction(sim.wolf_population_history)]
+                remaining = [r for r in remaining if r is not None]
+                if remaining and ticks + min(remaining) <= MAX_TICKS:
+                    return ticks + min(remaining)
     return ticks
 
 
-def objective(trial):
-    params = {
+def run_batch(params_list, seed=None, report_every=REPORT_EVERY, predict=True):
+    sim = BatchSimulation(params_list, seed=seed)
+    while sim.has_active_worlds() and sim.ticks <= MAX_TICKS:
+        sim.tick()
+        if predict and sim.ticks % report_every == 0:
+            for world in sim.worlds:
+                remaining = [predict_extinction(sim.sheep_population_history[world]),
+                             predict_extinction(sim.wolf_population_history[world])]
+                remaining = [r for r in remaining if r is not None]
+                if remaining and sim.ticks + min(remaining) <= MAX_TICKS:
+                    sim.retire([world], sim.ticks + min(remaining))
+    sim.retire(sim.worlds, sim.ticks)
+    return sim.extinction_ticks.tolist()
+
+
+def suggest_params(trial):
+    return {
         "sheep_max_hunger": trial.suggest_int("sheep_max_hunger", 30, 50),
         "wolf_max_hunger": trial.suggest_int("wolf_max_hunger", 30, 40),
         "sheep_reproduction_rate": trial.suggest_float("sheep_reproduction_rate", 0.01, 0.1),
@@ -23,13 +90,153 @@ def objective(trial):
         "grass_growth_rate": trial.suggest_float("grass_growth_rate", 0.01, 0.05),
     }
 
-    time_alive = run_simulation(params)
-    return time_alive
+
+def objective(trial, replicates=1, aggregate="mean", base_seed=None, report_every=REPORT_EVERY, predict=True,
+              engine="object"):
+    # In-process counterpart of optimize_parallel for study.optimize: the first replicate reports to the trial, so
+    # the pruner works without a file-backed storage.
+    params = suggest_params(trial)
+    ticks = [run_simulation(params, replicate_seed(base_seed, trial, replicate), trial if replicate == 0 else None,
+                            report_every, predict, engine) for replicate in range(replicates)]
+    trial.set_user_attr("replicate_ticks", ticks)
+    return AGGREGATES[aggregate](ticks)
+
+
+def create_storage(path):
+    if path is None:
+        return None
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return f"sqlite:///{path}"
+    return JournalStorage(JournalFileBackend(path))
+
+
+def replicate_seed(base_seed, trial, replicate):
+    if base_seed is None:
+        return None
+    return [base_seed, trial.number, replicate]
+
+
+def run_replicate(params, seed, storage=None, study_name=None, pruner=None, trial_id=None,
+                  report_every=REPORT_EVERY, predict=True, engine="object"):
+    trial = None
+    if trial_id is not None:
+        study = optuna.load_study(study_name=study_name, storage=create_storage(storage), pruner=pruner)
+        trial = optuna.trial.Trial(study, trial_id)
+    return run_simulation(params, seed, trial, report_every, predict, engine)
+
+
+def optimize_parallel(study, n_trials, jobs, replicates=1, aggregate="mean", base_seed=None, storage=None,
+                      report_every=REPORT_EVERY, predict=True, engine="object"):
+    # Every (trial, replicate) pair is a separate task, so both levels share one pool of worker processes.
+    # Optuna's sampler only runs in this process. With a file-backed storage the first replicate of each trial
+    # reopens the study in its worker to report intermediate values, and a pruned trial cancels its siblings.
+    pending = {}
+    results = {}
+    asked = 0
+    with ProcessPoolExecutor(jobs) as pool:
+        while asked < n_trials or pending:
+            while asked < n_trials and len(results) < jobs:
+                trial = study.ask()
+                params = suggest_params(trial)
+                results[trial.number] = []
+                for replicate in range(replicates):
+                    seed = replicate_seed(base_seed, trial, replicate)
+                    scout = replicate == 0 and storage is not None
+                    future = pool.submit(run_replicate, params, seed, storage, study.study_name, study.pruner,
+                                         trial._trial_id if scout else None, report_every, predict, engine)
+                    pending[future] = trial
+                asked += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial = pending.pop(future, None)
+                if trial is None:
+                    continue
+                if isinstance(future.exception(), optuna.TrialPruned):
+                    for sibling in [f for f, t in pending.items() if t is trial]:
+                        sibling.cancel()
+                        del pending[sibling]
+                    del results[trial.number]
+                    study.tell(trial, state=TrialState.PRUNED)
+                    continue
+                results[trial.number].append(future.result())
+                if len(results[trial.number]) == replicates:
+                    ticks = results.pop(trial.number)
+                    trial.set_user_attr("replicate_ticks", ticks)
+                    study.tell(trial, AGGREGATES[aggregate](ticks))
+
+
+def optimize_batched(study, n_trials, jobs, batch_size, replicates=1, aggregate="mean", base_seed=None,
+                     report_every=REPORT_EVERY, predict=True):
+    # Each task asks batch_size trials at once and simulates all their replicates as one BatchSimulation.
+    # Optuna pruners are not consulted here; hopeless worlds are still retired by the extinction predictor.
+    pending = {}
+    asked = 0
+    with ProcessPoolExecutor(jobs) as pool:
+        while asked < n_trials or pending:
+            while asked < n_trials and len(pending) < jobs:
+                trials = [study.ask() for _ in range(min(batch_size, n_trials - asked))]
+                params_list = [suggest_params(trial) for trial in trials for _ in range(replicates)]
+                seed = None if base_seed is None else [base_seed, trials[0].number]
+                pending[pool.submit(run_batch, params_list, seed, report_every, predict)] = trials
+                asked += len(trials)
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                trials = pending.pop(future)
+                ticks = future.result()
+                for i, trial in enumerate(trials):
+                    trial_ticks = ticks[i * replicates:(i + 1) * replicates]
+                    trial.set_user_attr("replicate_ticks", trial_ticks)
+                    study.tell(trial, AGGREGATES[aggregate](trial_ticks))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Search predator/prey parameters that keep both species alive.")
+    parser.add_argument("--engine", choices=ENGINES, default="object",
+                        help="simulation engine for unbatched trials; scores differ between engines")
+    parser.add_argument("--trials", type=int, default=200, help="total number of finished trials to reach")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--replicates", type=int, default=1, help="seeded runs per trial")
+    parser.add_argument("--aggregate", choices=AGGREGATES, default="mean", help="how replicate scores are combined")
+    parser.add_argument("--seed", type=int, default=None, help="base seed for replicate runs")
+    parser.add_argument("--storage", default=None,
+                        help="*.db/*.sqlite for SQLite, any other path for a journal file; enables resuming")
+    parser.add_argument("--study-name", default="predandprey")
+    parser.add_argument("--pruner", choices=PRUNERS, default=None,
+                        help="Optuna pruner fed with population balance; needs --jobs 1 or --storage, and no "
+                             "--batch-size (default: median where it can run, none otherwise)")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="simulate this many trials per task in one batched simulation (disables pruning)")
+    parser.add_argument("--report-every", type=int, default=REPORT_EVERY, help="ticks between intermediate reports")
+    parser.add_argument("--predict-extinction", action=argparse.BooleanOptionalAction, default=True,
+                        help="stop runs whose population trend is heading to extinction")
+    args = parser.parse_args()
+    pruning = args.batch_size == 0 and (args.jobs == 1 or args.storage is not None)
+    if args.pruner is None:
+        args.pruner = "median" if pruning else "none"
+    elif args.pruner != "none" and not pruning:
+        parser.error("--pruner needs --jobs 1 or --storage, and no --batch-size")
+    return args
 
 
 if __name__ == "__main__":
-    study = optuna.create_study(direction="maximize")
-    study.optimize(objective, n_trials=200)
+    args = parse_args()
+    study = optuna.create_study(study_name=args.study_name, storage=create_storage(args.storage),
+                                pruner=PRUNERS[args.pruner](), direction="maximize", load_if_exists=True)
+    finished = study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED))
+    remaining = args.trials - len(finished)
+
+    if remaining > 0 and args.batch_size > 0:
+        optimize_batched(study, remaining, args.jobs, args.batch_size, args.replicates, args.aggregate, args.seed,
+                         args.report_every, args.predict_extinction)
+    elif remaining > 0 and args.jobs == 1:
+        study.optimize(partial(objective, replicates=args.replicates, aggregate=args.aggregate, base_seed=args.seed,
+                               report_every=args.report_every, predict=args.predict_extinction, engine=args.engine),
+                       n_trials=remaining)
+    elif remaining > 0:
+        optimize_parallel(study, remaining, args.jobs, args.replicates, args.aggregate, args.seed, args.storage,
+                          args.report_every, args.predict_extinction, args.engine)
 
     print("Best parameters:", study.best_params)
     print("Best score:", study.best_value)
@@ -0,0 +1,64 @@
+import itertools
+
+import numpy as np
+
+BLOCK_SIZE = 1 << 16
+DIRECTION_ORDERS = [list(order) for order in itertools.permutations([(-1, 0), (1, 0), (0, -1), (0, 1)])]
+
+
+def resolve_seed(seed):
+    # An explicit seed is kept as is; otherwise fresh OS entropy is drawn once so the run can still be logged
+    # and replayed.
+    return np.random.SeedSequence().entropy if seed is None else seed
+
+
+class RandomStream:
+    # Per-simulation source of randomness for the object engines. Floats and direction orders are drawn from a
+    # NumPy Generator in large blocks, so an entity decision costs a list lookup instead of an RNG call.
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        self.seed = resolve_seed(seed)
+        self.generator = np.random.default_rng(self.seed)
+        self.block_size = block_size
+        self.floats, self.float_index, self.floats_state = [], 0, None
+        self.orders, self.order_index, self.orders_state = [], 0, None
+
+    def draw_floats(self):
+        return self.generator.random(self.block_size).tolist()
+
+    def draw_orders(self):
+        return self.generator.integers(len(DIRECTION_ORDERS), size=self.block_size).tolist()
+
+    def random(self):
+        if self.float_index == len(self.floats):
+            self.floats_state = self.generator.bit_generator.state
+            self.floats, self.float_index = self.draw_floats(), 0
+        value = self.floats[self.float_index]
+        self.float_index += 1
+        return value
+
+    def directions(self):
+        if self.order_index == len(self.orders):
+            self.orders_state = self.generator.bit_generator.state
+            self.orders, self.order_index = self.draw_orders(), 0
+        order = DIRECTION_ORDERS[self.orders[self.order_index]]
+        self.order_index += 1
+        return order
+
+    def get_state(self):
+        # The current blocks are not stored; the generator states they were drawn from are enough to redraw them.
+        return {"generator": self.generator.bit_generator.state, "block_size": self.block_size,
+                "floats_state": self.floats_state, "float_index": self.float_index,
+                "orders_state": self.orders_state, "order_index": self.order_index}
+
+    def set_state(self, state):
+        self.block_size = state["block_size"]
+        self.floats, self.orders = [], []
+        if state["floats_state"] is not None:
+            self.generator.bit_generator.state = state["floats_state"]
+            self.floats = self.draw_floats()
+        if state["orders_state"] is not None:
+            self.generator.bit_generator.state = state["orders_state"]
+            self.orders = self.draw_orders()
+        self.floats_state, self.float_index = state["floats_state"], state["float_index"]
+        self.orders_state, self.order_index = state["orders_state"], state["order_index"]
+        self.generator.bit_generator.state = state["generator"]
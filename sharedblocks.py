@@ -0,0 +1,59 @@
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+
+# Shared-memory blocks this process has attached to, by name, with the arrays laid over them.
+ATTACHED = {}
+
+
+def attach(name, views, *args):
+    # views(buffer, *args) lays the arrays over the block; they are kept with it, so a worker attaches only once.
+    if name not in ATTACHED:
+        block = shared_memory.SharedMemory(name)
+        ATTACHED[name] = (block, views(block.buf, *args))
+    return ATTACHED[name][1]
+
+
+def detach_all():
+    blocks = [block for block, _ in ATTACHED.values()]
+    ATTACHED.clear()
+    for block in blocks:
+        block.close()
+
+
+def init_worker():
+    # A forked worker inherits the parent's entries, whose arrays the parent still holds; it attaches on its own
+    # instead. multiprocessing runs this finalizer when the worker exits, which atexit hooks would miss.
+    ATTACHED.clear()
+    util.Finalize(None, detach_all, exitpriority=0)
+
+
+class StripPool:
+    # Owns a shared-memory block and the process pool whose workers step it strip by strip, attaching the block by
+    # name. The block is unlinked on close(), or at exit if close() was never called.
+    def open_block(self, size, views, *args, jobs=None):
+        self.block = shared_memory.SharedMemory(create=True, size=max(1, size))
+        ATTACHED[self.block.name] = (self.block, views(self.block.buf, *args))
+        self.pool = ProcessPoolExecutor(jobs, initializer=init_worker) if jobs != 1 else None
+        atexit.register(self.close)
+        return ATTACHED[self.block.name][1]
+
+    def map_strips(self, tasks):
+        if self.pool is None:
+            return [tasks(strip) for strip in range(self.strips)]
+        return list(self.pool.map(tasks, range(self.strips)))
+
+    def close(self):
+        # Subclasses drop their own views of the block first.
+        atexit.unregister(self.close)
+        if self.pool is not None:
+            self.pool.shutdown()
+        ATTACHED.pop(self.block.name)
+        self.block.close()
+        self.block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,12 +1,29 @@
-import random
+import argparse
+from functools import partial
 
+import matplotlib.pyplot as plt
 import numpy as np
 import pygame
 
+from gridarrays import cell_classes, choose_directions, direction_masks, neighbour_cells
+from gridview import GridRenderer
+from headless import add_headless_arguments, fast_forward, print_summary, read_replay, replicate_seeds, run_replicates
+from randomstream import RandomStream, resolve_seed
+from stepper import Stepper
+
 # Constants
 GRID_SIZE = 200
 CELL_SIZE = 3
 WIDTH, HEIGHT = GRID_SIZE * CELL_SIZE, GRID_SIZE * CELL_SIZE
+TICK_FPS = 10
+DISPLAY_FPS = 60
+
+DEFAULT_PARAMS = {'death_chance': 0.01,
+                  'infection_duration': 100,
+                  'immunity_duration': 50,
+                  'move_probability': 0.5,
+                  'susceptible_density': 0.07,
+                  'infected_density': 0.001}
 
 # Pygame Colors
 EMPTY = (20, 20, 20)
@@ -14,6 +31,12 @@ SUSCEPTIBLE = (200, 200, 200)
 INFECTED = (200, 10, 10)
 RECOVERED = (10, 200, 10)
 
+# Cell kinds
+KIND_EMPTY, KIND_SUSCEPTIBLE, KIND_INFECTED, KIND_RECOVERED = range(4)
+COLORS = [EMPTY, SUSCEPTIBLE, INFECTED, RECOVERED]
+KIND_NAMES = ["empty", "susceptible", "infected", "recovered"]
+HISTORY_NAMES = ["susceptible", "infected", "recovered", "dead"]
+
 
 class Entity:
     def __init__(self, x, y, color):
@@ -21,11 +44,37 @@ class Entity:
         self.y = y
         self.color = color
 
-    def tick(self, grid):
+    def tick(self, grid, params, population, rng):
         pass
 
 
+class Population:
+    def __init__(self, grid):
+        self.counts = self.recount(grid)
+        self.dead = 0
+
+    @staticmethod
+    def recount(grid):
+        counts = [0] * len(COLORS)
+        for row in grid:
+            for entity in row:
+                counts[entity.kind] += 1
+        return counts
+
+    def place(self, grid, x, y, entity):
+        self.counts[grid[x, y].kind] -= 1
+        self.counts[entity.kind] += 1
+        grid[x, y] = entity
+
+    def check(self, grid):
+        expected = self.recount(grid)
+        if self.counts != expected:
+            raise RuntimeError(f"Population counters {self.counts} do not match grid recount {expected}")
+
+
 class Empty(Entity):
+    kind = KIND_EMPTY
+
     def __init__(self, x, y):
         super().__init__(x, y, EMPTY)
 
@@ -34,112 +83,338 @@ class Human(Entity):
     def __init__(self, x, y, color):
         super().__init__(x, y, color)
 
-    def random_move(self, grid):
-        if random.random() < 0.5:
-            for new_x, new_y in self.adjacent_cells():
+    def random_move(self, grid, params, population, rng):
+        if rng.random() < params["move_probability"]:
+            for new_x, new_y in self.adjacent_cells(rng):
                 if isinstance(grid[new_x, new_y], Empty):
-                    self.move(grid, new_x, new_y)
+                    self.move(grid, population, new_x, new_y)
                     break
 
-    def move(self, grid, new_x, new_y):
-        grid[new_x, new_y] = self
-        grid[self.x, self.y] = Empty(self.x, self.y)
+    def move(self, grid, population, new_x, new_y):
+        population.place(grid, new_x, new_y, self)
+        population.place(grid, self.x, self.y, Empty(self.x, self.y))
         self.x, self.y = new_x, new_y
 
-    def adjacent_cells(self):
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        random.shuffle(directions)
-        for dx, dy in directions:
+    def adjacent_cells(self, rng):
+        for dx, dy in rng.directions():
             yield (self.x + dx) % GRID_SIZE, (self.y + dy) % GRID_SIZE
 
-    def take_action(self, grid):
+    def take_action(self, grid, params, population, rng):
         pass
 
-    def tick(self, grid):
-        self.random_move(grid)
-        self.take_action(grid)
+    def tick(self, grid, params, population, rng):
+        self.random_move(grid, params, population, rng)
+        self.take_action(grid, params, population, rng)
 
 
 class Susceptible(Human):
+    kind = KIND_SUSCEPTIBLE
+
     def __init__(self, x, y):
         super().__init__(x, y, SUSCEPTIBLE)
 
 
 class Infected(Human):
-    def __init__(self, x, y):
+    kind = KIND_INFECTED
+
+    def __init__(self, x, y, params):
         super().__init__(x, y, INFECTED)
-        self.duration = 100
+        self.duration = params["infection_duration"]
 
-    def take_action(self, grid):
-        self.attempt_die(grid)
-        self.infect(grid)
-        self.recover(grid)
+    def take_action(self, grid, params, population, rng):
+        self.attempt_die(grid, params, population, rng)
+        self.infect(grid, params, population, rng)
+        if grid[self.x, self.y] is self:
+            self.recover(grid, params, population)
 
-    def recover(self, grid):
+    def recover(self, grid, params, population):
         self.duration -= 1
         if self.duration <= 0:
-            grid[self.x, self.y] = Recovered(self.x, self.y)
+            population.place(grid, self.x, self.y, Recovered(self.x, self.y, params))
 
-    def infect(self, grid):
-        for new_x, new_y in self.adjacent_cells():
+    def infect(self, grid, params, population, rng):
+        for new_x, new_y in self.adjacent_cells(rng):
             if isinstance(grid[new_x, new_y], Susceptible):
-                grid[new_x, new_y] = Infected(new_x, new_y)
+                population.place(grid, new_x, new_y, Infected(new_x, new_y, params))
 
-    def attempt_die(self, grid):
-        if random.random() <= 0.01:
-            grid[self.x, self.y] = Empty(self.x, self.y)
+    def attempt_die(self, grid, params, population, rng):
+        if rng.random() <= params["death_chance"]:
+            population.place(grid, self.x, self.y, Empty(self.x, self.y))
+            population.dead += 1
 
 
 class Recovered(Human):
-    def __init__(self, x, y):
+    kind = KIND_RECOVERED
+
+    def __init__(self, x, y, params):
         super().__init__(x, y, RECOVERED)
-        self.duration = 50
+        self.duration = params["immunity_duration"]
 
-    def take_action(self, grid):
+    def take_action(self, grid, params, population, rng):
         self.duration -= 1
         if self.duration <= 0:
-            grid[self.x, self.y] = Susceptible(self.x, self.y)
+            population.place(grid, self.x, self.y, Susceptible(self.x, self.y))
 
 
 class Simulation:
-    def __init__(self, params):
+    engine = "object"
+
+    def __init__(self, params, seed=None, debug=False):
         self.params = params
+        self.debug = debug
+        self.rng = RandomStream(seed)
+        self.seed = self.rng.seed
+        self.ticks = 0
         self.grid = np.array([[Empty(i, j) for j in range(GRID_SIZE)] for i in range(GRID_SIZE)])
         self.populate()
+        self.population = Population(self.grid)
+        self.history = {name: [] for name in HISTORY_NAMES}
 
     def populate(self):
         for i in range(GRID_SIZE):
             for j in range(GRID_SIZE):
-                rnd = random.random()
-                if rnd < 0.07:
+                rnd = self.rng.random()
+                if rnd < self.params["susceptible_density"]:
                     self.grid[i, j] = Susceptible(i, j)
-                elif rnd < 0.071:
-                    self.grid[i, j] = Infected(i, j)
+                elif rnd < self.params["susceptible_density"] + self.params["infected_density"]:
+                    self.grid[i, j] = Infected(i, j, self.params)
         # self.grid[GRID_SIZE//2][GRID_SIZE//2] = Infected(GRID_SIZE//2, GRID_SIZE//2)
 
     def tick(self):
         for row in self.grid:
             for entity in row:
-                entity.tick(self.grid)
+                entity.tick(self.grid, self.params, self.population, self.rng)
+        if self.debug:
+            self.population.check(self.grid)
+        self.ticks += 1
+        self.record_history()
+
+    def record_history(self):
+        counts = self.counts()
+        for name, count in zip(HISTORY_NAMES, (*counts[KIND_SUSCEPTIBLE:], self.dead())):
+            self.history[name].append(int(count))
+
+    def run_until(self, condition, max_ticks=None):
+        while not condition(self) and (max_ticks is None or self.ticks < max_ticks):
+            self.tick()
+        return self
+
+    def kinds(self):
+        return np.array([[entity.kind for entity in row] for row in self.grid], dtype=np.uint8)
+
+    def counts(self):
+        return list(self.population.counts)
+
+    def dead(self):
+        return self.population.dead
+
+    def plot_history(self):
+        plt.figure(figsize=(10, 5))
+        for name, color in zip(HISTORY_NAMES, ['grey', 'red', 'green', 'black']):
+            plt.plot(self.history[name], label=name.capitalize(), color=color)
+        plt.xlabel('Time Step')
+        plt.ylabel('Population')
+        plt.title('SIR Over Time')
+        plt.legend()
+        plt.grid(True)
+        plt.show()
+
+
+class ArraySimulation:
+    # Cellular-automaton version of Simulation: kinds and infection/immunity countdowns live in flat arrays and a
+    # tick is a handful of whole-grid operations, so grids of a few thousand cells per side stay interactive.
+    # The state counters are updated from the size of each transition instead of recounting the grid.
+    engine = "array"
+
+    def __init__(self, params, seed=None, grid_size=GRID_SIZE):
+        assert grid_size % 5 == 0, "grid size must be a multiple of 5"
+        self.params = params
+        self.seed = resolve_seed(seed)
+        self.rng = np.random.default_rng(self.seed)
+        self.ticks = 0
+        self.grid_size = grid_size
+        self.kind = np.zeros(grid_size * grid_size, dtype=np.uint8)
+        self.duration = np.zeros(grid_size * grid_size, dtype=np.int16)
+        self.populate()
+        self.population = np.bincount(self.kind, minlength=len(COLORS))
+        self.deaths = 0
+        self.history = {name: [] for name in HISTORY_NAMES}
+
+    def populate(self):
+        rnd = self.rng.random(self.kind.size)
+        self.kind[rnd < self.params["susceptible_density"] + self.params["infected_density"]] = KIND_INFECTED
+        self.kind[rnd < self.params["susceptible_density"]] = KIND_SUSCEPTIBLE
+        self.duration[self.kind == KIND_INFECTED] = self.params["infection_duration"]
+
+    def tick(self):
+        self.move_humans()
+        infected = self.kind == KIND_INFECTED
+        exposed = self.exposed(infected)
+        self.die(np.flatnonzero(infected))
+        self.count_down(infected)
+        self.kind[exposed] = KIND_INFECTED
+        self.duration[exposed] = self.params["infection_duration"]
+        self.transfer(KIND_SUSCEPTIBLE, KIND_INFECTED, np.count_nonzero(exposed))
+        self.ticks += 1
+        self.record_history()
+
+    def transfer(self, source, target, count):
+        self.population[source] -= count
+        self.population[target] += count
+
+    def move_humans(self):
+        # Each human steps with the move probability to a random empty neighbour. Movers are split into the five
+        # independent classes so the moves of one class never collide.
+        occupied = np.flatnonzero(self.kind)
+        movers = occupied[self.rng.random(occupied.size) < self.params["move_probability"]]
+        classes = cell_classes(movers, self.grid_size)
+        acted = np.zeros(self.kind.size, dtype=bool)
+        for c in self.rng.permutation(5):
+            cells = movers[classes == c]
+            cells = cells[~acted[cells]]
+            neighbours = neighbour_cells(cells, self.grid_size)
+            masks = direction_masks(self.kind[neighbours] == KIND_EMPTY)
+            moves = masks != 0
+
+            src = cells[moves]
+            dest = neighbours[moves, choose_directions(masks[moves], self.rng)]
+            self.kind[dest] = self.kind[src]
+            self.duration[dest] = self.duration[src]
+            self.kind[src] = KIND_EMPTY
+            self.duration[src] = 0
+            acted[dest] = True
+
+    def exposed(self, infected):
+        # Susceptible cells with an infected von Neumann neighbour on the torus.
+        grid = infected.reshape(self.grid_size, self.grid_size)
+        near = np.roll(grid, 1, 0) | np.roll(grid, -1, 0) | np.roll(grid, 1, 1) | np.roll(grid, -1, 1)
+        return near.ravel() & (self.kind == KIND_SUSCEPTIBLE)
+
+    def die(self, cells):
+        deaths = cells[self.rng.random(cells.size) <= self.params["death_chance"]]
+        self.kind[deaths] = KIND_EMPTY
+        self.duration[deaths] = 0
+        self.transfer(KIND_INFECTED, KIND_EMPTY, deaths.size)
+        self.deaths += deaths.size
+
+    def count_down(self, infected):
+        timed = self.kind >= KIND_INFECTED
+        self.duration -= timed
+        expired = timed & (self.duration <= 0)
+        recovering = expired & infected
+        losing_immunity = expired & ~infected
+        self.kind[recovering] = KIND_RECOVERED
+        self.duration[recovering] = self.params["immunity_duration"]
+        self.kind[losing_immunity] = KIND_SUSCEPTIBLE
+        self.transfer(KIND_INFECTED, KIND_RECOVERED, np.count_nonzero(recovering))
+        self.transfer(KIND_RECOVERED, KIND_SUSCEPTIBLE, np.count_nonzero(losing_immunity))
+
+    def kinds(self):
+        return self.kind.reshape(self.grid_size, self.grid_size)
+
+    def counts(self):
+        return self.population.copy()
+
+    def dead(self):
+        return self.deaths
+
+    record_history = Simulation.record_history
+    run_until = Simulation.run_until
+    plot_history = Simulation.plot_history
+
+
+class SparseSimulation(ArraySimulation):
+    # ArraySimulation driven by index sets instead of whole-grid passes: the sorted flat cells of all humans and,
+    # each tick, the infected among them. A tick costs time proportional to the number of humans, so large sparse
+    # worlds stay cheap. Same seed, same run as ArraySimulation.
+    engine = "sparse"
+
+    def __init__(self, params, seed=None, grid_size=GRID_SIZE):
+        super().__init__(params, seed, grid_size)
+        self.occupied = np.flatnonzero(self.kind)
+
+    def tick(self):
+        self.move_humans()
+        infected = self.occupied[self.kind[self.occupied] == KIND_INFECTED]
+        exposed = self.exposed(infected)
+        self.die(infected)
+        self.occupied = self.occupied[self.kind[self.occupied] != KIND_EMPTY]
+        self.count_down()
+        self.kind[exposed] = KIND_INFECTED
+        self.duration[exposed] = self.params["infection_duration"]
+        self.transfer(KIND_SUSCEPTIBLE, KIND_INFECTED, exposed.size)
+        self.ticks += 1
+        self.record_history()
+
+    def move_humans(self):
+        # Movers are positions in the occupied set rather than cells, so a human moves at most once per tick.
+        movers = np.flatnonzero(self.rng.random(self.occupied.size) < self.params["move_probability"])
+        classes = cell_classes(self.occupied[movers], self.grid_size)
+        for c in self.rng.permutation(5):
+            agents = movers[classes == c]
+            cells = self.occupied[agents]
+            neighbours = neighbour_cells(cells, self.grid_size)
+            masks = direction_masks(self.kind[neighbours] == KIND_EMPTY)
+            moves = masks != 0
+
+            src = cells[moves]
+            dest = neighbours[moves, choose_directions(masks[moves], self.rng)]
+            self.kind[dest] = self.kind[src]
+            self.duration[dest] = self.duration[src]
+            self.kind[src] = KIND_EMPTY
+            self.duration[src] = 0
+            self.occupied[agents[moves]] = dest
+        self.occupied.sort()
+
+    def exposed(self, infected):
+        neighbours = neighbour_cells(infected, self.grid_size).ravel()
+        return np.unique(neighbours[self.kind[neighbours] == KIND_SUSCEPTIBLE])
+
+    def count_down(self):
+        timed = self.occupied[self.kind[self.occupied] >= KIND_INFECTED]
+        self.duration[timed] -= 1
+        expired = timed[self.duration[timed] <= 0]
+        was_infected = self.kind[expired] == KIND_INFECTED
+        recovering, losing_immunity = expired[was_infected], expired[~was_infected]
+        self.kind[recovering] = KIND_RECOVERED
+        self.duration[recovering] = self.params["immunity_duration"]
+        self.kind[losing_immunity] = KIND_SUSCEPTIBLE
+        self.transfer(KIND_INFECTED, KIND_RECOVERED, recovering.size)
+        self.transfer(KIND_RECOVERED, KIND_SUSCEPTIBLE, losing_immunity.size)
+
+
+def status(simulation):
+    counts = simulation.counts()
+    return (f"S {counts[KIND_SUSCEPTIBLE]}  I {counts[KIND_INFECTED]}  R {counts[KIND_RECOVERED]}  "
+            f"dead {simulation.dead()}")
 
 
 class App:
-    def __init__(self, simulation):
+    def __init__(self, simulation, threaded=False, ticks_per_second=None):
+        grid_size = len(simulation.kinds())
+        cell_size = max(1, WIDTH // grid_size)
         pygame.init()
-        self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
+        self.screen = pygame.display.set_mode((grid_size * cell_size, grid_size * cell_size))
         pygame.display.set_caption("SIR Simulation")
         self.simulation = simulation
         self.clock = pygame.time.Clock()
         self.continuous_mode = False
+        self.renderer = GridRenderer(self.screen, grid_size, cell_size, COLORS)
+        self.stepper = Stepper(simulation, ticks_per_second, status) if threaded else None
 
     def render(self):
-        self.screen.fill(EMPTY)
-        for i in range(GRID_SIZE):
-            for j in range(GRID_SIZE):
-                entity = self.simulation.grid[i, j]
-                pygame.draw.rect(self.screen, entity.color,
-                                 pygame.Rect(i * CELL_SIZE, j * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-        pygame.display.flip()
+        if self.stepper is None:
+            self.renderer.render(self.simulation.kinds(), self.clock.get_fps(), status(self.simulation))
+        else:
+            kinds, summary, ticks = self.stepper.snapshot()
+            self.renderer.render(kinds, self.clock.get_fps(),
+                                 f"tick {ticks}  {self.stepper.measured_tps:.0f} ticks/s  {summary}")
+
+    def step(self):
+        if self.stepper is None:
+            self.simulation.tick()
+        else:
+            self.stepper.step()
 
     def run(self):
         running = True
@@ -149,20 +424,82 @@ class App:
                     running = False
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_SPACE:
-                        self.simulation.tick()
+                        self.step()
                     elif event.key == pygame.K_RETURN:
                         self.continuous_mode = not self.continuous_mode
-
-            if self.continuous_mode:
+                        if self.stepper is not None:
+                            self.stepper.set_running(self.continuous_mode)
+                    elif event.key == pygame.K_f:
+                        self.renderer.show_stats = not self.renderer.show_stats
+                    elif event.key == pygame.K_p:
+                        self.simulation.plot_history()
+
+            if self.continuous_mode and self.stepper is None:
                 self.simulation.tick()
 
             self.render()
-            self.clock.tick(10)
+            self.clock.tick(TICK_FPS if self.stepper is None else DISPLAY_FPS)
 
+        if self.stepper is not None:
+            self.stepper.stop()
         pygame.quit()
 
 
+def tiled_simulation(params, seed=None, grid_size=GRID_SIZE):
+    # sir_tiled imports this module, so it is only imported once the tiled engine is picked.
+    from sir_tiled import TiledSimulation
+    return TiledSimulation(params, seed, grid_size)
+
+
+ENGINES = {Simulation.engine: Simulation, ArraySimulation.engine: ArraySimulation,
+           SparseSimulation.engine: SparseSimulation, "tiled": tiled_simulation}
+
+
+def build_simulation(engine, params, seed=None, grid_size=GRID_SIZE):
+    if engine == Simulation.engine:
+        return Simulation(params, seed=seed)
+    return ENGINES[engine](params, seed=seed, grid_size=grid_size)
+
+
+def epidemic_over(simulation):
+    return simulation.counts()[KIND_INFECTED] == 0
+
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--engine", choices=ENGINES, default="object",
+                        help="Simulation (one object per cell), the NumPy ArraySimulation, SparseSimulation, "
+                             "which only visits occupied cells, or TiledSimulation, which steps strips on a pool")
+    parser.add_argument("--grid-size", type=int, default=GRID_SIZE,
+                        help="cells per side for the array, sparse and tiled engines (a multiple of 10)")
+    parser.add_argument("--threaded", action="store_true",
+                        help="step the simulation on a background thread, independent of the display rate")
+    parser.add_argument("--tps", type=float, default=None,
+                        help="target ticks per second in threaded mode (default: as fast as possible)")
+    add_headless_arguments(parser, "sir_counts.bin")
+    args = parser.parse_args()
+    if args.grid_size % 10:
+        parser.error("--grid-size must be a multiple of 10")
+    if args.engine == Simulation.engine and args.grid_size != GRID_SIZE:
+        parser.error(f"the object engine runs on a fixed {GRID_SIZE}x{GRID_SIZE} grid")
+    return args
+
+
 if __name__ == "__main__":
-    simulation = Simulation({})
-    app = App(simulation)
-    app.run()
+    args = parse_args("SIR epidemic simulation.")
+    params = {**DEFAULT_PARAMS, **args.params}
+    seeds, replay_ticks = replicate_seeds(args.seed, args.replicates), 0
+    if args.replay:
+        log = read_replay(args.replay)
+        params, seeds, replay_ticks = {**DEFAULT_PARAMS, **log["params"]}, [log["seed"]], log["ticks"]
+        args.engine, args.grid_size = log.get("engine", "object"), log.get("grid_size", GRID_SIZE)
+
+    build = partial(build_simulation, args.engine, params, grid_size=args.grid_size)
+    if args.headless:
+        results = run_replicates(build, epidemic_over, KIND_NAMES, args.out, seeds, args.jobs,
+                                 args.ticks or replay_ticks or None, {"grid_size": args.grid_size})
+        print_summary(results, KIND_NAMES)
+    else:
+        simulation = fast_forward(build(seeds[0]), replay_ticks)
+        app = App(simulation, args.threaded, args.tps)
+        app.run()
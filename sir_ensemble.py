@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from headless import replicate_seeds
+from sir import DEFAULT_PARAMS, ENGINES, GRID_SIZE, HISTORY_NAMES, KIND_INFECTED, KIND_RECOVERED, build_simulation
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+SUMMARY = np.dtype([("seed", "<u8"), ("peak_infected", "<i4"), ("peak_tick", "<i4"), ("extinction_tick", "<i4"),
+                    ("dead", "<i4")])
+
+
+class RunningMoments:
+    # Welford's running mean and variance, element-wise over arrays of a fixed shape.
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, values):
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+
+class P2Quantiles:
+    # Jain and Chlamtac's P-square estimator: five markers per quantile track it without storing the observations.
+    # Every element of an array of a fixed shape (e.g. ticks x series) gets its own markers, updated together.
+    def __init__(self, levels, shape):
+        self.levels = np.asarray(levels, dtype=float)
+        self.shape = (len(levels), *shape)
+        size = int(np.prod(self.shape))
+        p = np.repeat(self.levels, size // len(levels))[:, None]
+        self.increments = np.hstack([np.zeros_like(p), p / 2, p, (1 + p) / 2, np.ones_like(p)])
+        self.desired = 1 + 4 * self.increments
+        self.positions = np.tile(np.arange(1.0, 6.0), (size, 1))
+        self.heights = np.zeros((size, 5))
+        self.first = []
+
+    def add(self, values):
+        values = np.broadcast_to(values, self.shape).ravel().astype(float)
+        if len(self.first) < 5:
+            self.first.append(values)
+            if len(self.first) == 5:
+                self.heights[:] = np.sort(np.stack(self.first, axis=1), axis=1)
+            return
+
+        q, n = self.heights, self.positions
+        np.minimum(q[:, 0], values, out=q[:, 0])
+        np.maximum(q[:, 4], values, out=q[:, 4])
+        cell = (values[:, None] >= q[:, 1:4]).sum(axis=1)
+        n += np.arange(5) > cell[:, None]
+        self.desired += self.increments
+
+        for i in range(1, 4):
+            d = self.desired[:, i] - n[:, i]
+            up = (d >= 1) & (n[:, i + 1] - n[:, i] > 1)
+            down = (d <= -1) & (n[:, i - 1] - n[:, i] < -1)
+            step = np.where(up, 1.0, -1.0)
+            parabolic = q[:, i] + step / (n[:, i + 1] - n[:, i - 1]) * (
+                    (n[:, i] - n[:, i - 1] + step) * (q[:, i + 1] - q[:, i]) / (n[:, i + 1] - n[:, i]) +
+                    (n[:, i + 1] - n[:, i] - step) * (q[:, i] - q[:, i - 1]) / (n[:, i] - n[:, i - 1]))
+            neighbour = np.where(up, i + 1, i - 1)
+            rows = np.arange(len(q))
+            linear = q[:, i] + step * (q[rows, neighbour] - q[:, i]) / (n[rows, neighbour] - n[:, i])
+            inside = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+            adjust = up | down
+            q[:, i] = np.where(adjust, np.where(inside, parabolic, linear), q[:, i])
+            n[:, i] += np.where(adjust, step, 0)
+
+    def values(self):
+        if len(self.first) < 5:
+            first = np.stack(self.first).reshape(-1, *self.shape)
+            return np.array([np.quantile(first[:, l], level, axis=0) for l, level in enumerate(self.levels)])
+        return self.heights[:, 2].reshape(self.shape)
+
+
+def run_replicate(engine, params, grid_size, max_ticks, seed):
+    # Runs one epidemic until nothing can change any more (no infected and no immunity left to lose) or until
+    # max_ticks, and returns its S/I/R/dead curve padded with the final state to max_ticks + 1 rows.
+    simulation = build_simulation(engine, params, seed, grid_size)
+    start = [*simulation.counts()[1:], 0]
+    simulation.run_until(settled, max_ticks)
+    curve = np.empty((max_ticks + 1, len(HISTORY_NAMES)), dtype=np.int32)
+    curve[0] = start
+    curve[1:simulation.ticks + 1] = np.array([simulation.history[name] for name in HISTORY_NAMES]).T
+    curve[simulation.ticks + 1:] = curve[simulation.ticks]
+    if hasattr(simulation, "close"):
+        simulation.close()
+    return seed, curve
+
+
+def settled(simulation):
+    counts = simulation.counts()
+    return counts[KIND_INFECTED] == 0 and counts[KIND_RECOVERED] == 0
+
+
+def ordered_results(pool, function, args, window):
+    # Like pool.map, but with at most `window` runs in flight, so finished curves never pile up in memory.
+    pending = deque()
+    for arg in args:
+        pending.append(pool.submit(function, *arg))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class Ensemble:
+    # Folds replicate curves into running moments and quantile bands as they arrive; only one scalar row per
+    # replicate (peak, extinction time, deaths) is kept.
+    def __init__(self, max_ticks, levels=QUANTILES):
+        shape = (max_ticks + 1, len(HISTORY_NAMES))
+        self.moments = RunningMoments(shape)
+        self.quantiles = P2Quantiles(levels, shape)
+        self.summaries = []
+
+    def add(self, seed, curve):
+        self.moments.add(curve)
+        self.quantiles.add(curve)
+        infected = curve[:, HISTORY_NAMES.index("infected")]
+        extinct = np.flatnonzero(infected == 0)
+        self.summaries.append((seed, infected.max(), infected.argmax(), extinct[0] if extinct.size else -1,
+                               curve[-1, HISTORY_NAMES.index("dead")]))
+
+    def summary(self):
+        return np.array(self.summaries, dtype=SUMMARY)
+
+    def save(self, path, **meta):
+        np.savez_compressed(path, names=HISTORY_NAMES, mean=self.moments.mean.astype(np.float32),
+                            std=self.moments.std().astype(np.float32), levels=self.quantiles.levels,
+                            quantiles=self.quantiles.values().astype(np.float32), replicates=self.summary(),
+                            meta=json.dumps(meta))
+
+
+def run_ensemble(params, replicates, max_ticks, engine="sparse", grid_size=GRID_SIZE, seed=None, jobs=None):
+    ensemble = Ensemble(max_ticks)
+    args = [(engine, params, grid_size, max_ticks, s) for s in replicate_seeds(seed, replicates)]
+    if jobs == 1:
+        for arg in args:
+            ensemble.add(*run_replicate(*arg))
+        return ensemble
+    with ProcessPoolExecutor(jobs) as pool:
+        for result in ordered_results(pool, run_replicate, args, 2 * (jobs or os.cpu_count())):
+            ensemble.add(*result)
+    return ensemble
+
+
+def load_ensemble(path):
+    with np.load(path) as data:
+        result = {key: data[key] for key in data.files}
+    result["meta"] = json.loads(str(result["meta"]))
+    return result
+
+
+def plot_ensemble(result):
+    ticks = np.arange(len(result["mean"]))
+    levels = list(result["levels"])
+    plt.figure(figsize=(10, 5))
+    for k, (name, color) in enumerate(zip(result["names"], ['grey', 'red', 'green', 'black'])):
+        bands = result["quantiles"][:, :, k]
+        plt.fill_between(ticks, bands[0], bands[-1], color=color, alpha=0.15)
+        if len(levels) > 2:
+            plt.fill_between(ticks, bands[1], bands[-2], color=color, alpha=0.25)
+        plt.plot(ticks, result["mean"][:, k], label=str(name).capitalize(), color=color)
+    plt.xlabel('Time Step')
+    plt.ylabel('Population')
+    plt.title(f"SIR ensemble of {len(result['replicates'])} runs ({levels[0]:.0%}-{levels[-1]:.0%} bands)")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+
+def print_ensemble(result):
+    replicates = result["replicates"]
+    extinct = replicates["extinction_tick"] >= 0
+    peaks = np.quantile(replicates["peak_infected"], [0.05, 0.5, 0.95])
+    print(f"{len(replicates)} runs; peak infected median {peaks[1]:.0f} (90% range {peaks[0]:.0f}-{peaks[2]:.0f}), "
+          f"mean peak tick {replicates['peak_tick'].mean():.0f}, mean deaths {replicates['dead'].mean():.0f}")
+    if extinct.any():
+        times = np.quantile(replicates["extinction_tick"][extinct], [0.05, 0.5, 0.95])
+        print(f"{extinct.mean():.0%} died out; time to extinction median {times[1]:.0f} "
+              f"(90% range {times[0]:.0f}-{times[2]:.0f})")
+    else:
+        print("no run died out")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many seeded SIR epidemics and aggregate their curves.")
+    parser.add_argument("--replicates", type=int, default=200)
+    parser.add_argument("--ticks", type=int, default=1000, help="length of every curve")
+    parser.add_argument("--engine", choices=ENGINES, default="sparse")
+    parser.add_argument("--grid-size", type=int, default=GRID_SIZE)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--params", type=json.loads, default={}, help="JSON object overriding simulation params")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--out", default="sir_ensemble.npz")
+    parser.add_argument("--plot", action="store_true", help="plot the mean curves with quantile bands")
+    args = parser.parse_args()
+
+    params = {**DEFAULT_PARAMS, **args.params}
+    ensemble = run_ensemble(params, args.replicates, args.ticks, args.engine, args.grid_size, args.seed, args.jobs)
+    ensemble.save(args.out, params=params, engine=args.engine, grid_size=args.grid_size, seed=args.seed)
+    result = load_ensemble(args.out)
+    print_ensemble(result)
+    if args.plot:
+        plot_ensemble(result)
@@ -0,0 +1,198 @@
+import argparse
+import json
+from functools import partial
+
+import numpy as np
+
+from gridarrays import choose_directions, direction_masks, neighbour_cells
+from headless import CountsWriter, save_replay
+from randomstream import resolve_seed
+from sharedblocks import StripPool, attach
+from sir import (COLORS, DEFAULT_PARAMS, HISTORY_NAMES, KIND_EMPTY, KIND_INFECTED, KIND_NAMES, KIND_RECOVERED,
+                 KIND_SUSCEPTIBLE, ArraySimulation, Simulation, epidemic_over)
+
+STRIPS = 16
+UPDATE_PHASE = 5
+
+
+def world_size(grid_size, strips):
+    return 4 * grid_size * grid_size + strips * 2 * grid_size
+
+
+def world_arrays(buffer, grid_size, strips):
+    # One block holds the kind, moved and duration grids and two halo rows per strip.
+    cells = grid_size * grid_size
+    kind = np.ndarray((grid_size, grid_size), dtype=np.uint8, buffer=buffer, offset=0)
+    moved = np.ndarray((grid_size, grid_size), dtype=np.bool_, buffer=buffer, offset=cells)
+    duration = np.ndarray((grid_size, grid_size), dtype=np.int16, buffer=buffer, offset=2 * cells)
+    halo = np.ndarray((strips, 2, grid_size), dtype=np.uint8, buffer=buffer, offset=4 * cells)
+    return kind, moved, duration, halo
+
+
+def attached(name, grid_size, strips):
+    return attach(name, world_arrays, grid_size, strips)
+
+
+def strip_rows(grid_size, strips, strip):
+    return strip * grid_size // strips, (strip + 1) * grid_size // strips
+
+
+def strip_rng(seed, tick, strip, phase):
+    # Randomness belongs to a strip and phase, not to a worker, so any number of workers gives the same run.
+    return np.random.default_rng([seed, tick, strip, phase])
+
+
+def class_cells(kind, grid_size, x0, x1, c):
+    # Occupied cells of class c in rows x0..x1 of the 2D grid. Row i holds that class in every fifth column from
+    # 3 * (c - i) mod 5, so each of the five row residues is one strided view. The views are copied before the
+    # scan because neighbouring strips may be writing into our border rows; the cells they touch are never of
+    # class c.
+    found = []
+    for x in range(x0, min(x0 + 5, x1)):
+        y = 3 * (c - x) % 5
+        rows, columns = np.nonzero(kind[x:x1:5, y::5].copy())
+        found.append((x + 5 * rows) * grid_size + y + 5 * columns)
+    return np.sort(np.concatenate(found))
+
+
+def move_strip(name, grid_size, strips, params, seed, tick, c, strip):
+    # Moves the humans of class c in one strip. Class c neighbourhoods are disjoint across the whole torus, so a
+    # human may step into a neighbouring strip's border row while that strip runs the same class.
+    kind, moved, duration, _ = attached(name, grid_size, strips)
+    x0, x1 = strip_rows(grid_size, strips, strip)
+    rng = strip_rng(seed, tick, strip, c)
+
+    cells = class_cells(kind, grid_size, x0, x1, c)
+    kind, moved, duration = kind.ravel(), moved.ravel(), duration.ravel()
+    cells = cells[~moved[cells]]
+    cells = cells[rng.random(cells.size) < params["move_probability"]]
+    neighbours = neighbour_cells(cells, grid_size)
+    masks = direction_masks(kind[neighbours] == KIND_EMPTY)
+    moves = masks != 0
+
+    src = cells[moves]
+    dest = neighbours[moves, choose_directions(masks[moves], rng)]
+    kind[dest] = kind[src]
+    duration[dest] = duration[src]
+    kind[src] = KIND_EMPTY
+    duration[src] = 0
+    moved[dest] = True
+
+
+def exchange_halo(name, grid_size, strips, strip):
+    kind, _, _, halo = attached(name, grid_size, strips)
+    x0, x1 = strip_rows(grid_size, strips, strip)
+    halo[strip, 0] = kind[x0 - 1]
+    halo[strip, 1] = kind[x1 % grid_size]
+
+
+def update_strip(name, grid_size, strips, params, seed, tick, strip):
+    # Infection, deaths, recovery and immunity loss for one strip. Only the strip's own rows are written; the rows
+    # beyond its borders come from the halo copied in the previous phase, before any strip started changing.
+    kind, moved, duration, halo = attached(name, grid_size, strips)
+    x0, x1 = strip_rows(grid_size, strips, strip)
+    kind, duration = kind[x0:x1], duration[x0:x1]
+    rng = strip_rng(seed, tick, strip, UPDATE_PHASE)
+
+    infected = kind == KIND_INFECTED
+    rows = np.concatenate([halo[strip, :1] == KIND_INFECTED, infected, halo[strip, 1:] == KIND_INFECTED])
+    near = rows[:-2] | rows[2:] | np.roll(infected, 1, 1) | np.roll(infected, -1, 1)
+    exposed = near & (kind == KIND_SUSCEPTIBLE)
+
+    cells = np.flatnonzero(infected)
+    deaths = cells[rng.random(cells.size) <= params["death_chance"]]
+    kind.ravel()[deaths] = KIND_EMPTY
+    duration.ravel()[deaths] = 0
+
+    timed = kind >= KIND_INFECTED
+    duration -= timed
+    expired = timed & (duration <= 0)
+    recovering = expired & infected
+    losing_immunity = expired & ~infected
+    kind[recovering] = KIND_RECOVERED
+    duration[recovering] = params["immunity_duration"]
+    kind[losing_immunity] = KIND_SUSCEPTIBLE
+
+    kind[exposed] = KIND_INFECTED
+    duration[exposed] = params["infection_duration"]
+    moved[x0:x1] = False
+    return (np.count_nonzero(exposed), deaths.size, np.count_nonzero(recovering),
+            np.count_nonzero(losing_immunity))
+
+
+class TiledSimulation(StripPool):
+    # ArraySimulation split into horizontal strips that a process pool steps over one shared-memory grid. A tick
+    # runs five move phases (one per independent class), a halo exchange and an update phase, with every strip
+    # finishing a phase before any starts the next. The run depends on the seed and the number of strips only.
+    engine = "tiled"
+
+    def __init__(self, params, seed=None, grid_size=4000, strips=STRIPS, jobs=None):
+        assert grid_size % 5 == 0, "grid size must be a multiple of 5"
+        self.params = params
+        self.seed = resolve_seed(seed)
+        self.rng = np.random.default_rng(self.seed)
+        self.ticks = 0
+        self.grid_size = grid_size
+        # Every strip needs at least one row of its own.
+        self.strips = strips = min(strips, grid_size)
+        kind, moved, duration, _ = self.open_block(world_size(grid_size, strips), world_arrays, grid_size, strips,
+                                                   jobs=jobs)
+        self.kind, self.duration = kind.ravel(), duration.ravel()
+        moved[:] = False
+        self.populate()
+        self.population = np.bincount(self.kind, minlength=len(COLORS))
+        self.deaths = 0
+        self.history = {name: [] for name in HISTORY_NAMES}
+
+    populate = ArraySimulation.populate
+
+    def map(self, function, *args):
+        return self.map_strips(partial(function, self.block.name, self.grid_size, self.strips, *args))
+
+    def tick(self):
+        for c in self.rng.permutation(5):
+            self.map(move_strip, self.params, self.seed, self.ticks, c)
+        self.map(exchange_halo)
+        exposed, deaths, recovering, losing_immunity = np.sum(
+            self.map(update_strip, self.params, self.seed, self.ticks), axis=0)
+        self.transfer(KIND_SUSCEPTIBLE, KIND_INFECTED, exposed)
+        self.transfer(KIND_INFECTED, KIND_EMPTY, deaths)
+        self.transfer(KIND_INFECTED, KIND_RECOVERED, recovering)
+        self.transfer(KIND_RECOVERED, KIND_SUSCEPTIBLE, losing_immunity)
+        self.deaths += int(deaths)
+        self.ticks += 1
+        self.record_history()
+
+    transfer = ArraySimulation.transfer
+    counts = ArraySimulation.counts
+    dead = ArraySimulation.dead
+    record_history = Simulation.record_history
+    run_until = Simulation.run_until
+    kinds = ArraySimulation.kinds
+
+    def close(self):
+        del self.kind, self.duration
+        super().close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a large SIR world headless on all cores.")
+    parser.add_argument("--grid-size", type=int, default=4000)
+    parser.add_argument("--strips", type=int, default=STRIPS, help="strips the grid is split into; part of the run")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--ticks", type=int, default=None, help="stop after this many ticks (default: run to the end)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--params", type=json.loads, default={}, help="JSON object overriding simulation params")
+    parser.add_argument("--out", default="sir_tiled_counts.bin")
+    args = parser.parse_args()
+
+    params = {**DEFAULT_PARAMS, **args.params}
+    with TiledSimulation(params, args.seed, args.grid_size, args.strips, args.jobs) as simulation:
+        with CountsWriter(args.out, KIND_NAMES) as writer:
+            writer.append(simulation.ticks, simulation.counts())
+            while (args.ticks is None or simulation.ticks < args.ticks) and not epidemic_over(simulation):
+                simulation.tick()
+                writer.append(simulation.ticks, simulation.counts())
+        save_replay(f"{args.out}.replay.json", simulation, grid_size=args.grid_size, strips=simulation.strips)
+        final = ", ".join(f"{name}={count}" for name, count in zip(KIND_NAMES, simulation.counts()))
+        print(f"{args.out}: seed={simulation.seed} ticks={simulation.ticks} {final}")
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import numpy as np
+
+
+class Stepper:
+    # Advances a simulation on a worker thread and publishes its kinds() grid through two buffers. The worker fills
+    # the back buffer without holding the lock and only swaps under it, so a reader always gets a completed tick.
+    # With summarize, summarize(simulation) is taken next to the grid and swapped in with it.
+    def __init__(self, simulation, ticks_per_second=None, summarize=None):
+        self.simulation = simulation
+        self.ticks_per_second = ticks_per_second
+        self.summarize = summarize
+        self.front = simulation.kinds().copy()
+        self.summary = summarize(simulation) if summarize else None
+        self.back = np.empty_like(self.front)
+        self.ticks = 0
+        self.measured_tps = 0.0
+        self.running = False
+        self.pending_steps = 0
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def set_running(self, running):
+        with self.lock:
+            self.running = running
+        self.wake.set()
+
+    def step(self):
+        with self.lock:
+            self.pending_steps += 1
+        self.wake.set()
+
+    def latest(self):
+        with self.lock:
+            return self.front.copy()
+
+    def snapshot(self):
+        # The grid, its summary and its tick, all from the same completed tick.
+        with self.lock:
+            return self.front.copy(), self.summary, self.ticks
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+        self.thread.join()
+
+    def loop(self):
+        deadline = time.perf_counter()
+        window_start, window_ticks = deadline, 0
+        while True:
+            self.wake.wait()
+            if self.stopped:
+                return
+            with self.lock:
+                if self.pending_steps:
+                    self.pending_steps -= 1
+                elif not self.running:
+                    self.wake.clear()
+                    deadline = window_start = time.perf_counter()
+                    window_ticks = 0
+                    self.measured_tps = 0.0
+                    continue
+
+            self.simulation.tick()
+            np.copyto(self.back, self.simulation.kinds())
+            summary = self.summarize(self.simulation) if self.summarize else None
+            with self.lock:
+                self.front, self.back = self.back, self.front
+                self.summary = summary
+                self.ticks += 1
+
+            now = time.perf_counter()
+            window_ticks += 1
+            if now - window_start >= 1:
+                self.measured_tps = window_ticks / (now - window_start)
+                window_start, window_ticks = now, 0
+            if self.ticks_per_second:
+                deadline = max(deadline + 1 / self.ticks_per_second, now - 1)
+                time.sleep(max(0.0, deadline - now))